@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#Canto-curses - ncurses RSS reader
+#   Copyright (C) 2016 Jack Miller <jack@codezen.org>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License version 2 as
+#   published by the Free Software Foundation.
+
+from collections.abc import Mapping
+
+import sys
+
+# The AttributeStore holds the attributes of every story we know about.
+#
+# Each story's attributes are an immutable AttrRecord with a version that
+# increases every time the story changes, so anyone holding a record can tell
+# whether it's current with a single comparison, and (id, version) is a valid
+# key for caching anything derived from the content.
+#
+# To keep records small, they don't carry a dict. Stories mostly share the same
+# handful of keys, so records with the same keys share an AttrLayout mapping
+# each attribute to a column of a plain values tuple. Repeated values
+# (canto-state and canto-tags lists, empty strings, short strings like authors)
+# are pooled so that they're stored once.
+#
+# The store can also be given a budget (in bytes, roughly estimated), in which
+# case it's kept as an LRU cache. Records are touched when the stories they
+# belong to are on (or near) the screen, and the least recently used are
+# evicted, to be asked for again if they're needed.
+
+# Strings longer than this (titles, links, descriptions) are unlikely to
+# repeat, so there's no point in pooling them.
+
+POOL_MAX_LEN = 32
+
+# Rough per-record / per-container overhead for the budget estimate.
+
+RECORD_SIZE = 160
+CONTAINER_SIZE = 64
+
+class AttrLayout(object):
+    __slots__ = [ "attrs", "index", "extended" ]
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.index = dict([ (attr, i) for (i, attr) in enumerate(attrs) ])
+
+        # new attrs -> AttrLayout, so that common transitions (i.e. getting
+        # description when the reader opens) don't need a lookup by full key.
+
+        self.extended = {}
+
+class AttrRecord(Mapping):
+    __slots__ = [ "id", "version", "layout", "values", "size" ]
+
+    def __init__(self, id, version, layout, values, size=0):
+        self.id = id
+        self.version = version
+        self.layout = layout
+        self.values = values
+        self.size = size
+
+    def __getitem__(self, attr):
+        return self.values[self.layout.index[attr]]
+
+    def __contains__(self, attr):
+        return attr in self.layout.index
+
+    def __iter__(self):
+        return iter(self.layout.attrs)
+
+    def __len__(self):
+        return len(self.values)
+
+    # Records are immutable, so this is as good as an id for memoizing
+    # anything derived from the content.
+
+    @property
+    def key(self):
+        return (self.id, self.version)
+
+    # A copy with some existing values replaced, for plugins that edit content
+    # for display (i.e. cleantitle). This doesn't change the store, so the
+    # version stays the same.
+
+    def replace(self, d):
+        values = list(self.values)
+        for attr, value in d.items():
+            values[self.layout.index[attr]] = value
+        return AttrRecord(self.id, self.version, self.layout, tuple(values))
+
+    # A plain dict copy, with tuples turned back into lists.
+
+    def copy(self):
+        return dict([ (attr, thaw_value(value)) for (attr, value) in\
+                zip(self.layout.attrs, self.values) ])
+
+    def __eq__(self, other):
+        if isinstance(other, AttrRecord):
+            other = other.copy()
+        return self.copy() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.copy())
+
+def thaw_value(value):
+    if type(value) == tuple:
+        return list(value)
+    return value
+
+# Estimate the memory used by a value we don't pool.
+
+def value_size(value):
+    t = type(value)
+    if t == str:
+        if len(value) > POOL_MAX_LEN:
+            return len(value)
+        return 0
+    elif t == dict:
+        return CONTAINER_SIZE + sum([ value_size(v) for v in value.values() ])
+    elif t == list:
+        return CONTAINER_SIZE + sum([ value_size(v) for v in value ])
+    return 0
+
+class AttributeStore(object):
+    def __init__(self):
+        self.records = {}
+        self.version = 0
+
+        self.layouts = {}
+        self.pool = {}
+
+        # id -> attributes we've changed locally (i.e. canto-state from
+        # item-state), that the daemon hasn't caught up with yet.
+
+        self.overrides = {}
+
+        self.empty_layout = self.layout(())
+
+        # 0 means unlimited.
+        self.budget = 0
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def layout(self, attrs):
+        if attrs not in self.layouts:
+            self.layouts[attrs] = AttrLayout(attrs)
+        return self.layouts[attrs]
+
+    def pooled(self, value):
+        t = type(value)
+        if t == str:
+            if len(value) <= POOL_MAX_LEN:
+                return sys.intern(value)
+        elif t == list or t == tuple:
+            for v in value:
+                if type(v) != str:
+                    return value
+            value = tuple([ sys.intern(v) for v in value ])
+            return self.pool.setdefault(value, value)
+        return value
+
+    def empty(self, id):
+        return AttrRecord(id, 0, self.empty_layout, ())
+
+    def _merge(self, id, d):
+        old = self.records.get(id)
+        if old is not None:
+            layout = old.layout
+            values = list(old.values)
+        else:
+            layout = self.empty_layout
+            values = []
+
+        new_attrs = tuple([ attr for attr in d if attr not in layout.index ])
+        if new_attrs:
+            if new_attrs not in layout.extended:
+                layout.extended[new_attrs] =\
+                        self.layout(layout.attrs + new_attrs)
+            layout = layout.extended[new_attrs]
+            values.extend([ None ] * len(new_attrs))
+
+        index = layout.index
+        for attr, value in d.items():
+            values[index[attr]] = self.pooled(value)
+
+        size = RECORD_SIZE + 8 * len(values) +\
+                sum([ value_size(v) for v in values ])
+
+        if old is not None:
+            self.size -= old.size
+            del self.records[id]
+        self.size += size
+
+        self.version += 1
+        record = AttrRecord(id, self.version, layout, tuple(values), size)
+        self.records[id] = record
+        return record
+
+    # Merge attributes from the daemon into id's record, returning the new
+    # record. Any local changes are applied on top one last time, so that a
+    # response already in flight when we made them can't revert them.
+
+    def update(self, id, d):
+        if id in self.overrides:
+            d = dict(d)
+            d.update(self.overrides.pop(id))
+        return self._merge(id, d)
+
+    # Merge our own changes into id's record, returning the new record.
+
+    def update_local(self, id, d):
+        if id in self.overrides:
+            self.overrides[id].update(d)
+        else:
+            self.overrides[id] = dict(d)
+        return self._merge(id, d)
+
+    def remove(self, id):
+        if id in self.records:
+            self.size -= self.records.pop(id).size
+        if id in self.overrides:
+            del self.overrides[id]
+
+    # Mark ids as recently used. Records is kept in LRU order (oldest first),
+    # so this is just moving them to the end.
+
+    def touch(self, ids):
+        records = self.records
+        for id in ids:
+            if id in records:
+                records[id] = records.pop(id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # Evict least recently used records until we're within budget, returning
+    # an empty record (with a new version) for each, so that whoever holds the
+    # old record knows to let it go.
+
+    def evict(self):
+        evicted = {}
+        if not self.budget:
+            return evicted
+
+        records = self.records
+        while self.size > self.budget and records:
+            id = next(iter(records))
+            self.size -= records.pop(id).size
+            self.evictions += 1
+
+            self.version += 1
+            evicted[id] = AttrRecord(id, self.version, self.empty_layout, ())
+
+        return evicted
+
+    def stats(self):
+        return { "records" : len(self.records), "size" : self.size,\
+                "budget" : self.budget, "hits" : self.hits,\
+                "misses" : self.misses, "evictions" : self.evictions }
+
+    def get(self, id):
+        return self.records.get(id)
+
+    def __contains__(self, id):
+        return id in self.records
+
+    def __getitem__(self, id):
+        return self.records[id]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
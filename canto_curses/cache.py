@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#Canto-curses - ncurses RSS reader
+#   Copyright (C) 2016 Jack Miller <jack@codezen.org>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License version 2 as
+#   published by the Free Software Foundation.
+
+# The ItemCache is an sqlite database in the config directory that holds the
+# ID lists of our tags, and the core attributes of their stories, as they were
+# when we last exited. On startup (with update.cache.persist set), TagUpdater
+# primes TagCores from it so that the first screen can be drawn without
+# waiting for the daemon, and then everything is reconciled as the daemon's
+# ITEMS and ATTRIBUTES come in.
+#
+# Each tag is a single row, with its IDs and the attributes of its stories
+# (that weren't already stored with an earlier tag) as JSON, because decoding
+# a few large blobs is much faster than a row per story.
+#
+# The cache is thrown away and rebuilt if its version doesn't match, it was
+# written for a different daemon, or sqlite finds it corrupt.
+
+import traceback
+import logging
+import sqlite3
+import json
+import os
+
+log = logging.getLogger("CACHE")
+
+CACHE_VERSION = 1
+
+class ItemCache(object):
+    def __init__(self, path, location):
+        self.path = path
+        self.location = location
+        self.db = None
+
+    def _connect(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _create(self):
+        c = self.db.cursor()
+        c.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        c.execute("CREATE TABLE tags (tag TEXT PRIMARY KEY, ids TEXT, attrs TEXT)")
+        c.executemany("INSERT INTO meta VALUES (?, ?)",\
+                [ ("version", str(CACHE_VERSION)), ("location", self.location) ])
+        self.db.commit()
+
+    def _valid(self):
+        c = self.db.cursor()
+        if c.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            log.info("Cache failed integrity check")
+            return False
+
+        meta = dict(c.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("version") != str(CACHE_VERSION):
+            log.info("Cache version mismatch: %s", meta.get("version"))
+            return False
+        if meta.get("location") != self.location:
+            log.info("Cache is for a different daemon: %s", meta.get("location"))
+            return False
+        return True
+
+    def _reset(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._connect()
+        self._create()
+
+    # Returns True if the cache is usable (even if empty).
+
+    def open(self):
+        try:
+            exists = os.path.exists(self.path)
+            self._connect()
+            if not exists:
+                self._create()
+            elif not self._valid():
+                self._reset()
+        except Exception as e:
+            log.error("Couldn't open cache %s: %s", self.path, e)
+            log.debug(traceback.format_exc())
+            try:
+                self._reset()
+            except Exception as e:
+                log.error("Couldn't recreate cache: %s", e)
+                self.db = None
+                return False
+        return True
+
+    # Return ({ tag : [ ids ] }, { id : attributes }). Anything unreadable is
+    # treated as not cached.
+
+    def load(self):
+        tags = {}
+        attributes = {}
+
+        if not self.db:
+            return tags, attributes
+
+        try:
+            c = self.db.cursor()
+            for tag, ids, attrs in c.execute("SELECT tag, ids, attrs FROM tags"):
+                tags[tag] = json.loads(ids)
+                attributes.update(json.loads(attrs))
+        except Exception as e:
+            log.error("Couldn't load cache, ignoring: %s", e)
+            self._reset()
+            return {}, {}
+
+        return tags, attributes
+
+    # Replace the contents of the cache, tags is { tag : [ ids ] } and
+    # attributes { id : attributes }.
+
+    def save(self, tags, attributes):
+        if not self.db:
+            return
+
+        rows = []
+        saved = set()
+
+        for tag, ids in tags.items():
+            attrs = {}
+            for id in ids:
+                if id in attributes and id not in saved:
+                    attrs[id] = attributes[id]
+                    saved.add(id)
+            rows.append((tag, json.dumps(ids), json.dumps(attrs)))
+
+        try:
+            c = self.db.cursor()
+            c.execute("DELETE FROM tags")
+            c.executemany("INSERT INTO tags VALUES (?, ?, ?)", rows)
+            self.db.commit()
+        except Exception as e:
+            log.error("Couldn't save cache: %s", e)
+            log.debug(traceback.format_exc())
+            self.db.rollback()
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
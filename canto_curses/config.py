@@ -18,16 +18,18 @@
 # deleted tags, but not for changes to existing tags.
 
 from canto_next.hooks import call_hook
-from canto_next.rwlock import RWLock, write_lock, read_lock
-from canto_next.remote import assign_to_dict, access_dict
+from canto_next.rwlock import write_lock, read_lock
 
 from .locks import config_lock
 from .subthread import SubThread
 
-from threading import Thread, Event, current_thread
+from concurrent.futures import Future, wait as wait_futures
+from threading import current_thread
+from collections import deque
 import traceback
 import logging
 import curses   # Colors
+import shlex
 import json
 import re
 
@@ -53,23 +55,335 @@ eval_settings = [\
     "story.(format_attrs|enumerated)"
 ]
 
-# Do the one-time compile for the setting regexes. This is called after
-# plugins are evaluated, but before curses_start
+# Do the one-time compile for the setting regexes, and build the option schema
+# from them and the validators. This is called after plugins are evaluated, but
+# before curses_start
 
 def finalize_eval_settings():
     global eval_settings
     eval_settings = [ re.compile(x) for x in eval_settings ]
+    config.build_schema(eval_settings)
+
+# Before finalize_eval_settings there's no schema yet, so just check the
+# patterns (which may not be compiled yet either).
 
 def needs_eval(option):
-    for reobj in eval_settings:
-        if reobj.match(option):
-            return True
-    return False
+    if config.schema is None:
+        for reobj in eval_settings:
+            if re.match(reobj, option):
+                return True
+        return False
+    return config.schema.needs_eval(option)
 
 story_needed_attrs = [ "title" ]
 
 CURRENT_CONFIG_VERSION = 1
 
+# Published configuration is frozen so that it can be handed out to readers
+# without copying. The only way to change it is through set_conf / set_opt and
+# friends, which build a new tree and publish it as a fresh ConfigSnapshot.
+
+class FrozenDict(dict):
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("config is read-only, use set_conf / set_opt")
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __ior__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+class FrozenList(list):
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("config is read-only, use set_conf / set_opt")
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __iadd__ = _immutable
+    __imul__ = _immutable
+    append = _immutable
+    clear = _immutable
+    extend = _immutable
+    insert = _immutable
+    pop = _immutable
+    remove = _immutable
+    reverse = _immutable
+    sort = _immutable
+
+# Already frozen subtrees are returned as-is, so unchanged sections are shared
+# between snapshots instead of being copied on every publish.
+
+def freeze(obj):
+    if type(obj) in [ FrozenDict, FrozenList ]:
+        return obj
+    if isinstance(obj, dict):
+        return FrozenDict([ (k, freeze(v)) for (k, v) in obj.items() ])
+    if isinstance(obj, list):
+        return FrozenList([ freeze(x) for x in obj ])
+    return obj
+
+# Return a private, mutable copy of a (possibly frozen) config tree.
+
+def thaw(obj):
+    if isinstance(obj, dict):
+        return dict([ (k, thaw(v)) for (k, v) in obj.items() ])
+    if isinstance(obj, list):
+        return [ thaw(x) for x in obj ]
+    return obj
+
+def opt_path(option):
+    return option.split(".")
+
+def access_frozen(root, path):
+    for key in path:
+        if not isinstance(root, dict) or key not in root:
+            return (False, None)
+        root = root[key]
+    return (True, root)
+
+# Return a copy of root with value assigned at path. Only the dicts along the
+# path are copied, everything else is shared with root, so validate_config can
+# recognize the untouched parts.
+
+def assign_path(root, path, value):
+    new_root = dict(root)
+    node = new_root
+    for key in path[:-1]:
+        if key in node and isinstance(node[key], dict):
+            node[key] = dict(node[key])
+        else:
+            node[key] = {}
+        node = node[key]
+    node[path[-1]] = value
+    return new_root
+
+# Changed maps every option path that has ever changed (i.e. "taglist",
+# "taglist.border", and for tags "tags.<tag>.<option>") to the generation of
+# the snapshot it last changed in.
+
+class ConfigSnapshot(object):
+    __slots__ = [ "generation", "config", "tag_config", "changed" ]
+
+    def __init__(self, generation, config, tag_config, changed):
+        self.generation = generation
+        self.config = config
+        self.tag_config = tag_config
+        self.changed = changed
+
+def tag_opt_path(tag, option):
+    return "tags." + tag + "." + option
+
+def change_paths(changes, prefix=""):
+    r = []
+    for key in changes:
+        path = prefix + key
+        r.append(path)
+        if isinstance(changes[key], dict):
+            r.extend(change_paths(changes[key], path + "."))
+    return r
+
+# OptDeps is the set of option paths a widget renders with. Calling it returns
+# the generation of the last change to any of them, so the widget can tell
+# whether it needs to re-render by comparing a single number, instead of
+# every widget listening for opt change hooks.
+
+class OptDeps(object):
+    __slots__ = [ "owner", "paths", "cached" ]
+
+    def __init__(self, owner, paths):
+        self.owner = owner
+        self.paths = paths
+        self.cached = (-1, 0)
+
+    def __call__(self):
+        snap = self.owner.snap
+        generation, value = self.cached
+        if snap.generation != generation:
+            changed = snap.changed
+            value = 0
+            for path in self.paths:
+                if path in changed and changed[path] > value:
+                    value = changed[path]
+            self.cached = (snap.generation, value)
+        return value
+
+# An OptAccessor is a pre-split option path that remembers the value it
+# resolved to until a new snapshot generation is published, so repeated reads
+# (i.e. once per story per render) are just a generation comparison.
+
+class OptAccessor(object):
+    __slots__ = [ "owner", "path", "tag", "cached" ]
+
+    def __init__(self, owner, option, tag=None):
+        self.owner = owner
+        self.path = opt_path(option)
+        self.tag = tag
+
+        # (generation, value), swapped as one so that a racing reader can
+        # never pair a value with the wrong generation.
+
+        self.cached = (-1, None)
+
+    def __call__(self):
+        snap = self.owner.snap
+        generation, value = self.cached
+        if snap.generation != generation:
+            if self.tag is None:
+                root = snap.config
+            else:
+                root = snap.tag_config.get(self.tag, self.owner.frozen_tag_template)
+
+            valid, value = access_frozen(root, self.path)
+            if not valid:
+                value = None
+
+            self.cached = (snap.generation, value)
+        return value
+
+# A ConfigTransaction holds config_lock (write) until it's done and, in the
+# meantime, collects the set_* calls made from its thread instead of
+# processing them one by one. Getters called from that thread see the pending
+# values. When the outermost transaction exits, everything is given to
+# prot_configs at once, so it's validated once, the hooks are called once, and
+# the daemon gets a single SETCONFIGS / DELCONFIGS and PING.
+
+# If the block raises, the pending changes are thrown away.
+
+class ConfigTransaction(object):
+    def __init__(self, owner):
+        self.owner = owner
+        self.thread = None
+        self.given = {}
+        self.future = None
+
+        # Set if tags need to be evaluated once the changes are published
+        # (i.e. switch_tags), as eval_tags only sees published config.
+
+        self.eval_tags = False
+
+    def __enter__(self):
+        config_lock.acquire_write()
+
+        # Nested transactions just add to the outermost one.
+
+        if not self.owner.txn:
+            self.thread = current_thread()
+            self.owner.txn = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if self.owner.txn is self:
+                self.owner.txn = None
+                if exc_type:
+                    log.debug("Discarding config transaction: %s", self.given)
+                elif self.given:
+                    self.future = self.owner.prot_configs(self.given, True)
+                    if self.eval_tags:
+                        self.owner.eval_tags()
+        finally:
+            config_lock.release_write()
+        return False
+
+    def merge(self, given):
+        for section in given:
+            if section in [ "tags", "defaults" ]:
+                if section not in self.given:
+                    self.given[section] = {}
+                self.given[section].update(given[section])
+            else:
+                self.given[section] = given[section]
+
+# The OptionSchema is a tree of every option that has a validator (plus the
+# daemon's tag / feed / defaults options), so that an option's validator, or
+# whether it needs eval, is found by walking its path instead of scanning.
+
+# Options inside of blocks that are validated as a whole (i.e. color.*,
+# *.key.*, *.window.*) aren't in the tree. Those fall back on the eval
+# regexes, and the answer is remembered.
+
+class SchemaNode(object):
+    __slots__ = [ "children", "validator", "evaluate" ]
+
+    def __init__(self):
+        self.children = {}
+        self.validator = None
+        self.evaluate = False
+
+class OptionSchema(object):
+    def __init__(self, eval_regexes):
+        self.eval_regexes = eval_regexes
+        self.root = SchemaNode()
+        self.eval_memo = {}
+
+    def _regex_eval(self, option):
+        for reobj in self.eval_regexes:
+            if reobj.match(option):
+                return True
+        return False
+
+    def add(self, option, validator=None):
+        node = self.root
+        for key in opt_path(option):
+            if key not in node.children:
+                node.children[key] = SchemaNode()
+            node = node.children[key]
+        node.validator = validator
+        node.evaluate = self._regex_eval(option)
+
+    def add_validators(self, prefix, validators):
+        for key in validators:
+            if type(validators[key]) == dict:
+                self.add_validators(prefix + key + ".", validators[key])
+            else:
+                self.add(prefix + key, validators[key])
+
+    def node(self, option):
+        node = self.root
+        for key in opt_path(option):
+            if key not in node.children:
+                return None
+            node = node.children[key]
+        return node
+
+    def validator(self, option):
+        node = self.node(option)
+        if node:
+            return node.validator
+        return None
+
+    def needs_eval(self, option):
+        if option not in self.eval_memo:
+            node = self.node(option)
+            if node and not node.children:
+                self.eval_memo[option] = node.evaluate
+            else:
+                self.eval_memo[option] = self._regex_eval(option)
+        return self.eval_memo[option]
+
+    # Return the full paths of the known options under prefix.
+
+    def completions(self, prefix=""):
+        if prefix:
+            node = self.node(prefix)
+            if not node:
+                return []
+            prefix += "."
+        else:
+            node = self.root
+
+        r = []
+        for key in node.children:
+            child = node.children[key]
+            if child.children:
+                r.extend(self.completions(prefix + key))
+            else:
+                r.append(prefix + key)
+        return r
+
 class CantoCursesConfig(SubThread):
 
     # The object init just sets up the default settings, doesn't
@@ -121,7 +435,19 @@ class CantoCursesConfig(SubThread):
                 {
                     "interval" : self.validate_uint,
                     "enabled" : self.validate_bool,
-                }
+                },
+                "lazy" :
+                {
+                    "enabled" : self.validate_bool,
+                    "prefetch" : self.validate_uint,
+                    "fill" : self.validate_uint,
+                },
+                "cache" :
+                {
+                    "budget" : self.validate_uint,
+                    "persist" : self.validate_bool,
+                },
+                "connections" : self.validate_uint,
             },
 
             "reader" :
@@ -196,7 +522,19 @@ class CantoCursesConfig(SubThread):
                 {
                     "interval" : 20,
                     "enabled" : False
-                }
+                },
+                "lazy" :
+                {
+                    "enabled" : False,
+                    "prefetch" : 100,
+                    "fill" : 500
+                },
+                "cache" :
+                {
+                    "budget" : 0,
+                    "persist" : False
+                },
+                "connections" : 0
             },
 
             "reader" :
@@ -414,8 +752,6 @@ class CantoCursesConfig(SubThread):
         for i in range(1, 257):
             self.template_config["color"][str(i)] = i - 1
 
-        self.config = eval(repr(self.template_config))
-
         self.tag_validators = {
             "enumerated" : self.validate_bool,
             "collapsed" : self.validate_bool,
@@ -423,8 +759,6 @@ class CantoCursesConfig(SubThread):
             "transform" : self.validate_string,
         }
 
-        self.tag_config = {}
-
         self.tag_template_config = {
             "enumerated" : False,
             "collapsed" : False,
@@ -432,11 +766,225 @@ class CantoCursesConfig(SubThread):
             "transform" : "None"
         }
 
+        self.frozen_tag_template = freeze(self.tag_template_config)
+
+        self.snap = ConfigSnapshot(0, freeze(self.template_config), FrozenDict(), {})
+
+        self.accessors = {}
+        self.tag_accessors = {}
+        self.all_deps = {}
+
+        # Tag options, with the template merged in, keyed by tag. Entries are
+        # built on first use, and are (template, tag config, resolved) so that
+        # they're only used while both are the ones still published. Frozen
+        # tag configs are replaced, never changed, so that's just an identity
+        # check, and a table built from a snapshot that's since been replaced
+        # is never served, however late it's stored.
+
+        self.resolved_tags = {}
+
+        # The ConfigTransaction in progress, if any.
+
+        self.txn = None
+
+        # With write_behind set, config writes don't wait for the daemon.
+        # Every write is followed by a PING, and its Future (in order) waits
+        # here for the matching PONG.
+
+        self.write_behind = True
+        self.pending_writes = deque()
+
+        # Var name -> [ (func, key), ... ], see watch(). The lists are replaced,
+        # never modified, so set_var can call them without a lock.
+
+        self.watchers = {}
+
+        # Built by finalize_eval_settings()
+
+        self.schema = None
+
+        # Completions for config options, see option_paths()
+
+        self.defaults_generation = 0
+        self.option_paths_for = None
+        self.option_paths_cache = []
+
+        # Tag -> position in the published tagorder, see tag_positions().
+
+        self.order_positions = {}
+        self.order_positions_for = None
+
+        # Tag -> whether it matches the tags setting, for the pattern in
+        # tag_matches_for.
+
+        self.tag_matches = {}
+        self.tag_matches_for = None
+
         self.daemon_defaults = {}
         self.daemon_feedconf = []
 
         self.initd = False
 
+    # The current snapshot is replaced wholesale on every change, so readers
+    # can grab self.snap (or these properties) without holding config_lock.
+
+    @property
+    def config(self):
+        return self.snap.config
+
+    @property
+    def tag_config(self):
+        return self.snap.tag_config
+
+    def snapshot(self):
+        return self.snap
+
+    # Accessors are shared, so every caller asking for the same option gets
+    # the same (already resolved) object.
+
+    def accessor(self, option):
+        if option not in self.accessors:
+            self.accessors[option] = OptAccessor(self, option)
+        return self.accessors[option]
+
+    def deps(self, paths):
+        key = tuple(paths)
+        if key not in self.all_deps:
+            self.all_deps[key] = OptDeps(self, key)
+        return self.all_deps[key]
+
+    def tag_accessor(self, tag, option):
+        key = (tag, option)
+        if key not in self.tag_accessors:
+            self.tag_accessors[key] = OptAccessor(self, option, tag)
+        return self.tag_accessors[key]
+
+    def _resolve_tag(self, tag):
+        template = self.frozen_tag_template
+        conf = self.snap.tag_config.get(tag)
+
+        entry = self.resolved_tags.get(tag)
+        if entry and entry[0] is template and entry[1] is conf:
+            return entry[2]
+
+        resolved = dict(template)
+        if conf:
+            resolved.update(conf)
+        resolved = FrozenDict(resolved)
+
+        self.resolved_tags[tag] = (template, conf, resolved)
+        return resolved
+
+    def transaction(self):
+        return ConfigTransaction(self)
+
+    def build_schema(self, eval_regexes):
+        schema = OptionSchema(eval_regexes)
+        schema.add_validators("", self.validators)
+        schema.add_validators("tag.", self.tag_validators)
+
+        for opt in [ "rate", "keep_time", "keep_unread" ]:
+            schema.add("feed." + opt)
+            schema.add("defaults." + opt)
+
+        self.schema = schema
+
+    # Return the list of every option that can be set, shlex quoted for
+    # completion. It's only rebuilt when the config (which includes any
+    # user keys, colors, etc.) or the daemon defaults change.
+
+    def option_paths(self):
+        key = (self.snap.generation, self.defaults_generation)
+        if self.option_paths_for != key:
+            paths = self._walk_options(self.snap.config, "")
+            paths.extend(self._walk_options(self.daemon_defaults, "defaults."))
+            paths.extend(self.schema.completions("tag"))
+            paths.extend(self.schema.completions("feed"))
+
+            self.option_paths_cache = sorted(set([ shlex.quote(x) for x in paths ]))
+            self.option_paths_for = key
+        return self.option_paths_cache
+
+    def _walk_options(self, obj, prefix):
+        r = []
+        for key in obj:
+            if isinstance(obj[key], dict):
+                r.extend(self._walk_options(obj[key], prefix + key + "."))
+            else:
+                r.append(prefix + key)
+        return r
+
+    # Return the given section of the transaction pending on this thread, or
+    # None if there isn't one.
+
+    def _pending(self, section):
+        txn = self.txn
+        if txn and txn.thread == current_thread() and section in txn.given:
+            return txn.given[section]
+        return None
+
+    def _cur_config(self):
+        pending = self._pending("CantoCurses")
+        if pending is not None:
+            return pending
+        return self.snap.config
+
+    def _cur_tag_conf(self, tag):
+        pending = self._pending("tags")
+        if pending and tag in pending:
+            return pending[tag]
+        return self._resolve_tag(tag)
+
+    # Return a dict of tag -> position in the current tagorder. It's kept up to
+    # date incrementally by new / switched tags, and otherwise rebuilt once
+    # when a different tagorder has been published.
+
+    # Must be called holding config_lock (write)
+
+    def tag_positions(self):
+        order = self.config["tagorder"]
+        if self.order_positions_for is not order:
+            self.order_positions = dict([ (tag, i) for (i, tag) in enumerate(order) ])
+            self.order_positions_for = order
+        return self.order_positions
+
+    # Adopt positions for the just published tagorder, if it agrees with them
+    # on the changed tags (i.e. validation didn't rearrange it).
+
+    def _update_tag_positions(self, positions, changed):
+        order = self.config["tagorder"]
+        if len(order) != len(positions):
+            return
+        for tag in changed:
+            if order[positions[tag]] != tag:
+                return
+        self.order_positions = positions
+        self.order_positions_for = order
+
+    # Must be called holding config_lock (write)
+
+    def _publish(self, config=None, tag_config=None, changed=[]):
+        if config is None:
+            config = self.snap.config
+        if tag_config is None:
+            tag_config = self.snap.tag_config
+
+        generation = self.snap.generation + 1
+
+        changed_gens = self.snap.changed
+        if changed:
+            changed_gens = dict(changed_gens)
+            for path in changed:
+                changed_gens[path] = generation
+
+        self.snap = ConfigSnapshot(generation, freeze(config),\
+                freeze(tag_config), changed_gens)
+
+    def _publish_tag_conf(self, tag, conf):
+        tag_config = dict(self.snap.tag_config)
+        tag_config[tag] = conf
+        self._publish(tag_config = tag_config)
+
     def init(self, backend, compatible_version):
         self.vars["location"] = backend.location_args
 
@@ -445,8 +993,6 @@ class CantoCursesConfig(SubThread):
         self.start_pthread()
 
         self.version = None
-        self.processed = Event()
-        self.processed.clear()
 
         self.write("VERSION", [])
         self.write("WATCHNEWTAGS", [])
@@ -501,18 +1047,22 @@ class CantoCursesConfig(SubThread):
         return (True, val)
 
     def validate_tag_order(self, val, d):
-        if type(val) != list:
+        if not isinstance(val, list):
             return (False, False)
 
-        # Strip items no longer relevant
-        for item in val[:]:
-            if item not in self.vars["strtags"]:
-                val.remove(item)
+        strtags = set(self.vars["strtags"])
+
+        # Strip items no longer relevant. This also thaws a FrozenList from
+        # the current snapshot (i.e. via set_opt).
+
+        val = [ item for item in val if item in strtags ]
 
         # Ensure all tags are inluded
+        present = set(val)
         for tag in self.vars["strtags"]:
-            if tag not in val:
+            if tag not in present:
                 val.append(tag)
+                present.add(tag)
 
         return (True, val)
 
@@ -758,6 +1308,10 @@ class CantoCursesConfig(SubThread):
     # when it failed. Return a dict containing all of the changes actually
     # made.
 
+    # Values that are unchanged from d have already been validated, so only
+    # the changed subtrees are walked. The exception is tagorder, which is
+    # validated against strtags and so can go bad without changing.
+
     # Note that unknown values are detected only to avoid access errors, they
     # are totally ignored and will never get changes processed.
 
@@ -778,19 +1332,29 @@ class CantoCursesConfig(SubThread):
             if key not in v:
                 continue
 
+            # Unchanged, skip
+            elif v[key] != self.validate_tag_order and key in d and\
+                    (c[key] is d[key] or c[key] == d[key]):
+                continue
+
             # Key is section, recurse, only add changes if there
             # are actual changes.
 
             elif type(v[key]) == dict:
+                if type(c[key]) == FrozenDict:
+                    c[key] = dict(c[key])
                 chgs, dels = self.validate_config(c[key], d[key], v[key])
                 if chgs:
                     changes[key] = chgs
                 if dels:
                     deletions[key] = dels
 
-            # Key is basic, validate
+            # Key is basic, validate. Validators expect (and may modify)
+            # plain containers, so give them a thawed copy of anything taken
+            # from a snapshot (i.e. by set_opt).
+
             else:
-                good, val = v[key](c[key], d[key])
+                good, val = v[key](thaw(c[key]), d[key])
 
                 # Value is good, pass on
                 if good:
@@ -798,7 +1362,7 @@ class CantoCursesConfig(SubThread):
                         dels = {}
                         if type(val) == list:
                             chgs, dels, = self._list_diff(val, d[key])
-                        elif type(val) == dict and type(d[key]) == dict:
+                        elif type(val) == dict and isinstance(d[key], dict):
                             for d_key in d[key].keys():
                                 if d_key not in c[key].keys():
                                     dels[d_key] = "DELETE"
@@ -833,20 +1397,77 @@ class CantoCursesConfig(SubThread):
     @write_lock(config_lock)
     def prot_listtags(self, tags):
         self.vars["strtags"] = tags
-        self.config["tagorder"] = tags
+
+        c = dict(self.config)
+        c["tagorder"] = tags
+        self._publish(config = c)
 
     def prot_version(self, version):
         self.version = version
 
+    # Errors are already logged (and so displayed) by SubThread. They don't
+    # say which request caused them, so rather than blame one write, we fail
+    # every write that's still waiting on its PONG.
+
+    # We can't take config_lock here, a blocking write_configs holds it while
+    # it waits on us, so work from a copy in case writes are queued meanwhile.
+    # The futures stay queued, so later PONGs still line up with their writes.
+
+    def fail_writes(self, error):
+        for future in list(self.pending_writes):
+            if not future.done():
+                future.set_exception(Exception("Config write failed: %s" % error))
+
+    def prot_errors(self, errors):
+        SubThread.prot_errors(self, errors)
+        self.fail_writes(errors)
+
+    def prot_except(self, exception):
+        SubThread.prot_except(self, exception)
+        self.fail_writes(exception)
+
     def prot_pong(self, empty):
-        self.processed.set()
+        if not self.pending_writes:
+            log.debug("Unexpected PONG")
+            return
+
+        future = self.pending_writes.popleft()
+        if not future.done():
+            future.set_result(True)
+
+    # Send all of the changes from one prot_configs call, followed by a single
+    # PING, and return a Future that's done when the daemon has processed them
+    # (or None if there was nothing to write).
+
+    # Unless write_behind is set, wait for it here. The protocol thread can
+    # never wait, as it's the one that will read the PONG.
+
+    # Must be called holding config_lock (write), so writes and their futures
+    # are queued in the same order.
+
+    def write_configs(self, sets, dels):
+        if not (sets or dels):
+            return None
+
+        future = Future()
+        self.pending_writes.append(future)
+
+        if sets:
+            self.write("SETCONFIGS", sets)
+        if dels:
+            self.write("DELCONFIGS", dels)
+        self.write("PING", [])
+
+        if not self.write_behind and current_thread() != self.prot_thread:
+            wait_futures([ future ])
+
+        return future
+
+    # Wait for all outstanding config writes to be acknowledged. Returns the
+    # (done, not_done) sets, like concurrent.futures.wait
 
-    def wait_write(self, cmd, args):
-        self.write(cmd, args)
-        if current_thread() != self.prot_thread:
-            self.write("PING", [])
-            self.processed.wait()
-            self.processed.clear()
+    def flush(self, timeout=None):
+        return wait_futures(list(self.pending_writes), timeout)
 
     # configs accepts any changes, calls the opt_change hooks and if write is
     # set, sends those changes to the daemon. It's called both when receving
@@ -856,9 +1477,23 @@ class CantoCursesConfig(SubThread):
     # Note that changes are the only ones propagated through hooks because they
     # are a superset of deletions (i.e. a deletion counts as a change).
 
+    # Inside of a transaction, our own changes are just collected and the
+    # whole lot is processed here once the transaction is done.
+
     @write_lock(config_lock)
     def prot_configs(self, given, write = False):
+        if write and self.txn and self.txn.thread == current_thread():
+            self.txn.merge(given)
+            return
+
         log.debug("prot_configs given:\n%s\n", json.dumps(given, indent=4, sort_keys=True))
+
+        sets = {}
+        dels = {}
+
+        tag_changes = {}
+        tag_config = None
+
         if "tags" in given:
             for tag in list(given["tags"].keys()):
                 ntc = given["tags"][tag]
@@ -868,15 +1503,20 @@ class CantoCursesConfig(SubThread):
                 changes, deletions =\
                         self.validate_config(ntc, tc, self.tag_validators)
 
+                if changes:
+                    if tag_config is None:
+                        tag_config = dict(self.snap.tag_config)
+                    tag_config[tag] = ntc
+                    tag_changes[tag] = changes
+
                 if write:
                     if changes:
-                        self.wait_write("SETCONFIGS", { "tags" : { tag : changes }})
+                        sets.setdefault("tags", {})[tag] = changes
                     if deletions:
-                        self.wait_write("DELCONFIGS", { "tags" : { tag : deletions }})
+                        dels.setdefault("tags", {})[tag] = deletions
 
-                if changes:
-                    self.tag_config[tag] = ntc
-                    call_hook("curses_tag_opt_change", [ { tag : changes } ])
+        new_config = None
+        opt_changes = {}
 
         if "CantoCurses" in given:
             new_config = given["CantoCurses"]
@@ -884,7 +1524,7 @@ class CantoCursesConfig(SubThread):
             if "config_version" in new_config:
                 self.config_version = new_config["config_version"]
 
-            changes, deletions =\
+            opt_changes, deletions =\
                     self.validate_config(new_config, self.config,\
                     self.validators)
 
@@ -896,93 +1536,141 @@ class CantoCursesConfig(SubThread):
 
                 self.config_version = CURRENT_CONFIG_VERSION
                 new_config["config_version"] = CURRENT_CONFIG_VERSION
-                changes["config_version"] = CURRENT_CONFIG_VERSION
+                opt_changes["config_version"] = CURRENT_CONFIG_VERSION
                 self.write("SETCONFIGS", { "CantoCurses" : {"config_version" : CURRENT_CONFIG_VERSION } })
 
             if write:
-                if changes:
-                    self.wait_write("SETCONFIGS", { "CantoCurses" : changes })
+                if opt_changes:
+                    sets["CantoCurses"] = opt_changes
 
                 if deletions:
-                    self.wait_write("DELCONFIGS", { "CantoCurses" : deletions })
+                    dels["CantoCurses"] = deletions
 
-            if changes:
-                self.config = new_config
-                call_hook("curses_opt_change", [ changes ])
-                if "tags" in changes:
-                    self.eval_tags()
+        def_changes = None
 
         if "defaults" in given:
 
-            changes = {}
+            def_changes = {}
 
             for key in given["defaults"]:
                 if key in self.daemon_defaults:
                     if given["defaults"][key] != self.daemon_defaults[key]:
-                        changes[key] = given["defaults"][key]
+                        def_changes[key] = given["defaults"][key]
                 else:
-                    changes[key] = given["defaults"][key]
+                    def_changes[key] = given["defaults"][key]
 
-            self.daemon_defaults.update(changes)
+            self.daemon_defaults.update(def_changes)
+            self.defaults_generation += 1
 
             if write:
-                self.wait_write("SETCONFIGS", { "defaults" : self.daemon_defaults })
-
-            call_hook("curses_def_opt_change", [ changes ])
+                sets["defaults"] = self.daemon_defaults
 
         if "feeds" in given:
 
             self.daemon_feedconf = given["feeds"]
             if write:
-                self.wait_write("SETCONFIGS", { "feeds" : self.daemon_feedconf })
+                sets["feeds"] = self.daemon_feedconf
+
+        future = None
+        if write:
+            future = self.write_configs(sets, dels)
+
+        if tag_changes or opt_changes:
+            if not opt_changes:
+                new_config = None
 
+            changed = change_paths(opt_changes)
+            for tag in tag_changes:
+                changed.append("tags." + tag)
+                for opt in tag_changes[tag]:
+                    changed.append(tag_opt_path(tag, opt))
+
+            self._publish(config = new_config, tag_config = tag_config,\
+                    changed = changed)
+
+        if tag_changes:
+            call_hook("curses_tag_opt_change", [ tag_changes ])
+
+        if opt_changes:
+            call_hook("curses_opt_change", [ opt_changes ])
+            if "tags" in opt_changes:
+                self.eval_tags()
+
+        if def_changes is not None:
+            call_hook("curses_def_opt_change", [ def_changes ])
+
+        if "feeds" in given:
             call_hook("curses_feed_opt_change", [ given["feeds"] ])
 
         self.initd = True
 
+        return future
+
     # Process new tags.
 
     @write_lock(config_lock)
     def prot_newtags(self, tags):
+        strtags = set(self.vars["strtags"])
 
         if not self.initd:
+            tagorder = self.config["tagorder"][:]
+            positions = set(tagorder)
             for tag in tags:
-                if tag not in self.vars["strtags"]:
+                if tag not in strtags:
                     self.vars["strtags"].append(tag)
-                if tag not in self.config["tagorder"]:
-                    self.config["tagorder"].append(tag)
+                    strtags.add(tag)
+                if tag not in positions:
+                    tagorder.append(tag)
+                    positions.add(tag)
+
+            self._publish(config = assign_path(self.config, [ "tagorder" ], tagorder))
             return
 
-        c = self.get_conf()
+        tagorder = self.config["tagorder"]
+        positions = self.tag_positions()
 
         # Likely the same as tags
-        changes = False
+        added = []
+        added_set = set()
         newtags = []
 
         for tag in tags:
-            if tag not in c["tagorder"]:
-                c["tagorder"] = c["tagorder"] + [ tag ]
-                changes = True
-
-            if tag not in self.vars["strtags"]:
-
-                # If we don't have configuration for this
-                # tag already, substitute the default template.
-
-                if tag not in self.tag_config:
-                    log.debug("Using default tag config for %s", tag)
-                    self.tag_config[tag] = self.tag_template_config.copy()
+            if tag not in positions and tag not in added_set:
+                added.append(tag)
+                added_set.add(tag)
 
+            if tag not in strtags:
                 self.vars["strtags"].append(tag)
+                strtags.add(tag)
                 newtags.append(tag)
-                changes = True
 
         # If there aren't really any tags we didn't know about, no bail.
 
-        if not changes:
+        if not (added or newtags):
             return
 
-        self.set_conf(c)
+        # If we don't have configuration for these tags already, substitute
+        # the default template.
+
+        tag_config = None
+        for tag in newtags:
+            if tag not in self.tag_config:
+                log.debug("Using default tag config for %s", tag)
+                if tag_config is None:
+                    tag_config = dict(self.tag_config)
+                tag_config[tag] = self.frozen_tag_template
+
+        if tag_config is not None:
+            self._publish(tag_config = tag_config)
+
+        if added:
+            self.set_conf(assign_path(self.config, [ "tagorder" ],\
+                    list(tagorder) + added))
+
+            positions = dict(positions)
+            for i, tag in enumerate(added):
+                positions[tag] = len(tagorder) + i
+            self._update_tag_positions(positions, added)
 
         for tag in newtags:
             log.debug("New tag %s", tag)
@@ -990,49 +1678,80 @@ class CantoCursesConfig(SubThread):
 
         self.eval_tags()
 
+    # The whole batch is processed at once, so the tagorder is only rewritten
+    # and tags only re-evaluated once, no matter how many tags are gone.
+
     @write_lock(config_lock)
     def prot_deltags(self, tags):
+        strtags = set(self.vars["strtags"])
+        deleted = []
+
+        for tag in tags:
+            if tag in strtags:
+                strtags.remove(tag)
+                deleted.append(tag)
+            elif self.initd:
+                log.debug("Got DELTAG for non-existent tag!")
+
+        deleted_set = set(deleted)
+
+        self.vars["strtags"] = [ x for x in self.vars["strtags"] if x not in deleted_set ]
+
+        for tag in deleted:
+            if tag in self.tag_matches:
+                del self.tag_matches[tag]
+
+        tagorder = self.config["tagorder"]
+        if self.initd:
+            positions = self.tag_positions()
+            gone = [ x for x in deleted if x in positions ]
+        else:
+            gone = tags
+
+        if gone:
+            gone = set(gone)
+            tagorder = [ x for x in tagorder if x not in gone ]
+
         if not self.initd:
-            for tag in tags:
-                if tag in self.vars["strtags"]:
-                    self.vars["strtags"].remove(tag)
-                if tag in self.config["tagorder"]:
-                    self.config["tagorder"].append(tag)
+            self._publish(config = assign_path(self.config, [ "tagorder" ], tagorder))
             return
 
-        c = self.get_conf()
-        changes = False
+        for tag in deleted:
+            call_hook("curses_del_tag", [ tag ])
 
-        for tag in tags:
-            if tag in self.vars["strtags"]:
-                if tag in c["tagorder"]:
-                    c["tagorder"] = [ x for x in self.config["tagorder"] if x != tag ]
-                    changes = True
-                self.vars["strtags"].remove(tag)
-                call_hook("curses_del_tag", [ tag ])
-                self.eval_tags()
-            else:
-                log.debug("Got DELTAG for non-existent tag!")
+        if gone:
+            self.set_conf(assign_path(self.config, [ "tagorder" ], tagorder))
 
-        if changes:
-            self.set_conf(c)
+        if deleted:
+            self.eval_tags()
 
     @write_lock(config_lock)
     def eval_tags(self):
         prevtags = self.vars["curtags"]
 
+        positions = self.tag_positions()
+
+        pattern = self.config["tags"]
+        if self.tag_matches_for != pattern:
+            self.tag_matches = {}
+            self.tag_matches_for = pattern
+        matches = self.tag_matches
+
         sorted_tags = []
-        r = re.compile(self.config["tags"])
+        r = re.compile(pattern)
 
         for tag in self.vars["strtags"]:
 
             # This can happen between the time that a tag is removed from the config
             # and the time that we receive a DELTAG event.
-            if tag not in self.config["tagorder"]:
+            if tag not in positions:
                 continue
 
-            elif r.match(tag):
-                sorted_tags.append((self.config["tagorder"].index(tag), tag))
+            if tag not in matches:
+                matches[tag] = r.match(tag) != None
+
+            if matches[tag]:
+                sorted_tags.append((positions[tag], tag))
         sorted_tags.sort()
 
         self.set_var("curtags", [ x for (i, x) in sorted_tags ])
@@ -1053,8 +1772,46 @@ class CantoCursesConfig(SubThread):
 
         if self.vars[tweak] != value:
             self.vars[tweak] = value
+
+            # Like call_hook, one broken watcher shouldn't stop the rest.
+
+            if tweak in self.watchers:
+                for func, key in self.watchers[tweak]:
+                    try:
+                        func({ tweak : value })
+                    except Exception as e:
+                        log.error("Error in %s watcher %s: %s" % (tweak, func, e))
+                        log.error(traceback.format_exc())
+
             call_hook("curses_var_change", [{ tweak : value }])
 
+    # Like on_hook("curses_var_change", ...), but func is only called for
+    # changes to the named var. It gets the same { var : value } argument.
+
+    # The curses_var_change hook is still called for every change, but
+    # anything that only cares about a few vars should watch them instead.
+
+    def watch(self, tweak, func, key=None):
+        watchers = self.watchers.get(tweak, [])
+        self.watchers[tweak] = watchers + [ (func, key) ]
+
+    def unwatch(self, tweak, func):
+        if tweak not in self.watchers:
+            return
+        watchers = [ (f, k) for (f, k) in self.watchers[tweak] if f != func ]
+        if watchers:
+            self.watchers[tweak] = watchers
+        else:
+            del self.watchers[tweak]
+
+    def unwatch_all(self, key):
+        for tweak in list(self.watchers.keys()):
+            watchers = [ (f, k) for (f, k) in self.watchers[tweak] if k != key ]
+            if watchers:
+                self.watchers[tweak] = watchers
+            else:
+                del self.watchers[tweak]
+
     def get_var(self, tweak):
         if tweak in self.vars:
             return self.vars[tweak]
@@ -1064,20 +1821,28 @@ class CantoCursesConfig(SubThread):
     # code can "get" the conf, which is a copy of the real conf, modify it,
     # then "set" the conf which will properly process the changes.
 
+    # The *_opt getters, on the other hand, return values straight out of the
+    # current snapshot. They're frozen, so they can be shared without copying.
+
     # prot_configs handles locking
 
+    # The setters return the Future for the daemon write, see write_configs.
+
     def set_conf(self, conf):
-        self.prot_configs({"CantoCurses" : conf }, True)
+        return self.prot_configs({"CantoCurses" : conf }, True)
 
     def set_tag_conf(self, tag, conf):
-        self.prot_configs({ "tags" : { tag : conf } }, True)
+        return self.prot_configs({ "tags" : { tag : conf } }, True)
 
     def set_def_conf(self, conf):
-        self.prot_configs({ "defaults" : conf }, True)
+        return self.prot_configs({ "defaults" : conf }, True)
 
     def set_feed_conf(self, name, conf):
         config_lock.acquire_read()
-        d_f = eval(repr(self.daemon_feedconf), {}, {})
+        d_f = self._pending("feeds")
+        if d_f is None:
+            d_f = self.daemon_feedconf
+        d_f = eval(repr(d_f), {}, {})
         config_lock.release_read()
 
         for f in d_f:
@@ -1088,69 +1853,97 @@ class CantoCursesConfig(SubThread):
         else:
             d_f.append(conf)
 
-        self.prot_configs({ "feeds" : d_f }, True)
+        return self.prot_configs({ "feeds" : d_f }, True)
 
-    @read_lock(config_lock)
     def get_conf(self):
-        return eval(repr(self.config), {}, {})
+        return thaw(self._cur_config())
 
-    @read_lock(config_lock)
     def get_tag_conf(self, tag):
-        if tag in self.tag_config:
-            return eval(repr(self.tag_config[tag]), {}, {})
-        return eval(repr(self.tag_template_config), {}, {})
+        return thaw(self._cur_tag_conf(tag))
 
     @read_lock(config_lock)
     def get_def_conf(self):
-        return eval(repr(self.daemon_defaults), {}, {})
+        d = dict(self.daemon_defaults)
+        pending = self._pending("defaults")
+        if pending:
+            d.update(pending)
+        return eval(repr(d), {}, {})
 
     @read_lock(config_lock)
     def get_feed_conf(self, name):
-        for f in self.daemon_feedconf:
+        d_f = self._pending("feeds")
+        if d_f is None:
+            d_f = self.daemon_feedconf
+        for f in d_f:
             if f["name"] == name:
                 return eval(repr(f), {}, {})
         return None
 
     @write_lock(config_lock)
     def set_opt(self, option, value):
-        c = self.get_conf()
-        assign_to_dict(c, option, value)
-        self.set_conf(c)
+        return self.set_conf(assign_path(self._cur_config(), opt_path(option), value))
 
-    @read_lock(config_lock)
     def get_opt(self, option):
-        c = self.get_conf()
-        valid, value = access_dict(c, option)
+        if self.txn:
+            root = self._cur_config()
+        else:
+            root = self.snap.config
+
+        valid, value = access_frozen(root, opt_path(option))
         if not valid:
             return None
         return value
 
     @write_lock(config_lock)
     def set_tag_opt(self, tag, option, value):
-        tc = self.get_tag_conf(tag)
-        assign_to_dict(tc, option, value)
-        self.set_tag_conf(tag, tc)
+        tc = self._cur_tag_conf(tag)
+        return self.set_tag_conf(tag, assign_path(tc, opt_path(option), value))
 
-    @read_lock(config_lock)
     def get_tag_opt(self, tag, option):
-        tc = self.get_tag_conf(tag)
-        valid, value = access_dict(tc, option)
+        if self.txn:
+            tc = self._cur_tag_conf(tag)
+        else:
+            tc = self._resolve_tag(tag)
+
+        # Tag options are flat, so this is normally just the one lookup.
+
+        if option in tc:
+            return tc[option]
+
+        valid, value = access_frozen(tc, opt_path(option))
         if not valid:
             return None
         return value
 
+    def _tag_position(self, order, positions, tag):
+        i = positions.get(tag, -1)
+        if i >= 0 and i < len(order) and order[i] == tag:
+            return i
+
+        # Inside a transaction, the pending tagorder may differ
+        return order.index(tag)
+
     @write_lock(config_lock)
     def switch_tags(self, tag1, tag2):
-        c = self.get_conf()
+        tagorder = list(self._cur_config()["tagorder"])
+        positions = self.tag_positions()
 
-        t1_idx = c["tagorder"].index(tag1)
-        t2_idx = c["tagorder"].index(tag2)
+        t1_idx = self._tag_position(tagorder, positions, tag1)
+        t2_idx = self._tag_position(tagorder, positions, tag2)
 
-        c["tagorder"][t1_idx] = tag2
-        c["tagorder"][t2_idx] = tag1
+        tagorder[t1_idx] = tag2
+        tagorder[t2_idx] = tag1
 
-        self.set_conf(c)
+        self.set_conf(assign_path(self._cur_config(), [ "tagorder" ], tagorder))
 
-        self.eval_tags()
+        positions = dict(positions)
+        positions[tag1] = t2_idx
+        positions[tag2] = t1_idx
+        self._update_tag_positions(positions, [ tag1, tag2 ])
+
+        if self.txn:
+            self.txn.eval_tags = True
+        else:
+            self.eval_tags()
 
 config = CantoCursesConfig()
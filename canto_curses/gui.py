@@ -21,9 +21,14 @@ from .screen import Screen
 from threading import Thread, Event
 import traceback
 import logging
+import time
 
 log = logging.getLogger("GUI")
 
+# Seconds of Tag.sync work per GUI pass.
+
+SYNC_SLICE = 0.005
+
 class GraphicalLog(logging.Handler):
 
     # We want to be able to catch logging output before the screen is actually
@@ -148,13 +153,17 @@ class CantoCursesGui(CommandHandler):
         self.do_gui.set()
 
     def tick(self):
-        c = self.callbacks["get_conf"]()
-        if c["update"]["auto"]["enabled"]:
+        # Fetch more attributes for off screen stories if we're idle.
+        if tag_updater.lazy and not self.working:
+            tag_updater.fill_attributes()
+
+        auto = self.callbacks["get_opt"]("update.auto")
+        if auto["enabled"]:
             self.sync_timer -= 1
             if self.sync_timer <= 0:
                 self.sync_requested = True
                 self.release_gui()
-                self.sync_timer = c["update"]["auto"]["interval"]
+                self.sync_timer = auto["interval"]
         else:
             self.sync_timer = 1
             if self.sync_requested:
@@ -274,9 +283,19 @@ class CantoCursesGui(CommandHandler):
                             (len(tag) == 0 and len(tag.tagcore) != 0)):
                         self.tags_to_sync.append(tag)
 
+            # Sync a slice of a tag per pass, tags on screen first, so that
+            # we're never holding sync_lock (and keeping input waiting) for
+            # long, even for huge tags. See Tag.sync.
+
             if self.tags_to_sync:
-                self.tags_to_sync[0].sync()
-                self.tags_to_sync = self.tags_to_sync[1:]
+                tag = self.tags_to_sync[0]
+                for t in self.tags_to_sync:
+                    if t.tag in tag_updater.priority_tags:
+                        tag = t
+                        break
+
+                if tag.sync(deadline=time.time() + SYNC_SLICE):
+                    self.tags_to_sync.remove(tag)
                 partial_sync = True
 
             needs_resize = self.callbacks["get_var"]("needs_resize") or self.winched
@@ -312,5 +331,9 @@ class CantoCursesGui(CommandHandler):
 
             sync_lock.release_write()
 
+            # Send any attribute requests made while rendering.
+
+            tag_updater.flush_attributes()
+
     def get_opt_name(self):
         return "main"
@@ -75,6 +75,29 @@ Common options:
         - True: interface will automatically add new items
         * False: new items have to be requested with :update (\\\ by default)
 
+    :set update.lazy.enabled [True|False]
+        - True: only fetch attributes for stories on screen, the rest later
+        * False: fetch attributes for all stories as they arrive
+    :set update.lazy.prefetch <stories>
+    :set update.lazy.fill <stories>
+        - How many off screen stories to fetch each second while idle (500)
+        - 0: only fetch stories as they come on screen
+
+    :set update.cache.budget <MB>
+        - Roughly how much memory story attributes can use before the least
+          recently seen are forgotten (and fetched again when needed).
+        * 0: unlimited
+
+    :set update.cache.persist [True|False]
+        - True: remember tags and stories on exit, to show them on startup
+          while the daemon catches up
+        * False: start empty and wait for the daemon
+
+    :set update.connections <count>
+        - Extra daemon connections to fetch tags over (after restart), the
+          first is reserved for tags on screen.
+        * 0: fetch everything over one connection
+
     %BTaglist cursor settings%b
 
     :set taglist.cursor.type [edge|top|middle|bottom]
@@ -255,7 +278,7 @@ Common options:
         self._remote("%s %s" % (remote_cmd, args))
 
     def _goto(self, urls):
-        browser = self.callbacks["get_conf"]()["browser"]
+        browser = self.callbacks["get_opt"]("browser")
 
         if not browser["path"]:
             log.error("No browser defined! Cannot goto.")
@@ -359,35 +382,11 @@ Common options:
     # Will offer completions for any recognized config option
     # Will *not* reject validly formatted options that don't already exist
 
-    def _get_current_config_options(self, obj, stack):
-        r = []
-
-        for item in obj.keys():
-            stack.append(item)
-
-            if type(obj[item]) == dict:
-                r.extend(self._get_current_config_options(obj[item], stack[:]))
-            else:
-                r.append(shlex.quote(".".join(stack)))
-
-            stack = stack[:-1]
-
-        return r
-
     def type_config_option(self):
-        conf = self.callbacks["get_conf"]()
-
-        possibles = self._get_current_config_options(conf, [])
-        possibles.extend(self._get_current_config_options(config.daemon_defaults, ["defaults"]))
-        possibles.extend(self._get_current_config_options(config.tag_template_config, ["tag"]))
-        possibles.extend(self._get_current_config_options({ "rate" : 10, "keep_time" : 86400, "keep_unread" : False}, ["feed"]))
-        possibles.sort()
-
-        return (possibles, lambda x : (True, x))
+        return (config.option_paths(), lambda x : (True, x))
 
     def type_config_section(self):
-        conf = self.callbacks["get_conf"]()
-        possibles = [ "" ] + list(conf.keys())
+        possibles = [ "" ] + list(config.config.keys())
         return (possibles, lambda x : (x in possibles, x))
 
     def cmd_set(self, opt, val):
@@ -12,3 +12,7 @@ config_lock = RWLock('config_lock')
 
 # This lock can be held with write to keep sync operations from happening.
 sync_lock = RWLock("global sync lock")
+
+# Held while applying ITEMS / ATTRIBUTES, so that responses arriving on
+# several tag connections (see TagLane) are applied one at a time.
+lane_lock = RWLock("tag lane lock")
@@ -225,6 +225,14 @@ class CantoCurses(CantoClient):
             self.gui.tick()
             time.sleep(1)
 
+        tag_updater.save_cache()
+
+        # Give any config writes still in flight a chance to land.
+
+        done, not_done = config.flush(5)
+        if not_done:
+            log.error("%d config writes not acknowledged by daemon" % len(not_done))
+
     def ensure_paths(self):
         if os.path.exists(self.conf_dir):
             if not os.path.isdir(self.conf_dir):
@@ -14,6 +14,7 @@ from .theme import prep_for_display
 from .html import htmlparser
 from .text import TextBox
 from .tagcore import tag_updater
+from .config import config
 from .color import cc
 
 import traceback
@@ -31,7 +32,7 @@ class Reader(TextBox):
 
         self.quote_rgx = re.compile("[\\\"](.*?)[\\\"]")
         on_hook("curses_opt_change", self.on_opt_change, self)
-        on_hook("curses_var_change", self.on_var_change, self)
+        config.watch("selected", self.on_var_change, self)
 
         args = {
             "link-list" : ("", self.type_link_list),
@@ -53,6 +54,7 @@ class Reader(TextBox):
 
     def die(self):
         unhook_all(self)
+        config.unwatch_all(self)
         unregister_all(self)
 
     def on_opt_change(self, change):
@@ -76,7 +78,7 @@ class Reader(TextBox):
         # If we've been instantiated and unfocused, and selection changes,
         # we need to be redrawn.
 
-        if "selected" in variables and variables["selected"]:
+        if variables["selected"]:
             self.callbacks["set_var"]("reader_item", variables["selected"])
             self.callbacks["set_var"]("needs_refresh", True)
             self.callbacks["release_gui"]()
@@ -135,24 +137,22 @@ class Reader(TextBox):
                 if reader_conf['show_enclosures']:
                     parsed_enclosures = []
 
+                    # Content is shared and versioned (see AttributeStore), so
+                    # default missing types here rather than filling them in.
+
                     if sel.content["links"]:
                         for lnk in sel.content["links"]:
                             if 'rel' in lnk and 'href' in lnk and lnk['rel'] == 'enclosure':
-                                if 'type' not in lnk:
-                                    lnk['type'] = 'unknown'
-                                parsed_enclosures.append((lnk['href'], lnk['type']))
-
-                    if sel.content["media_content"] and 'href' in sel.content["media_content"]:
-                        if 'type' not in sel.content["media_content"]:
-                            sel.content['media_content']['type'] = 'unknown'
-                        parsed_enclosures.append((sel.content["media_content"]['href'],\
-                                    sel.content["media_content"]['type']))
-
-                    if sel.content["enclosures"] and 'href' in sel.content["enclosures"]:
-                        if 'type' not in sel.content["enclosures"]:
-                            sel.content['enclosures']['type'] = 'unknown'
-                        parsed_enclosures.append((sel.content['enclosures']['href'],\
-                                    sel.content['enclosures']['type']))
+                                parsed_enclosures.append((lnk['href'],\
+                                        lnk.get('type', 'unknown')))
+
+                    mc = sel.content["media_content"]
+                    if mc and 'href' in mc:
+                        parsed_enclosures.append((mc['href'], mc.get('type', 'unknown')))
+
+                    enc = sel.content["enclosures"]
+                    if enc and 'href' in enc:
+                        parsed_enclosures.append((enc['href'], enc.get('type', 'unknown')))
 
                     if not parsed_enclosures:
                         mainbody += "<br />[ No enclosures. ]<br />"
@@ -215,9 +215,8 @@ class Reader(TextBox):
         self._goto(hrefs)
 
     def _toggle_cmd(self, opt):
-        c = self.callbacks["get_conf"]()
-        c["reader"][opt] = not c["reader"][opt]
-        self.callbacks["set_conf"](c)
+        opt = "reader." + opt
+        self.callbacks["set_opt"](opt, not self.callbacks["get_opt"](opt))
 
     def cmd_show_links(self):
         self._toggle_cmd("enumerate_links")
@@ -7,11 +7,10 @@
 #   published by the Free Software Foundation.
 
 from canto_next.plugins import Plugin, PluginHandler
-from canto_next.hooks import on_hook, unhook_all
 
 from .theme import FakePad, WrapPad, theme_print, theme_len, theme_reset, theme_border, prep_for_display
 from .tagcore import tag_updater
-from .config import story_needed_attrs
+from .config import config, story_needed_attrs
 from .color import cc
 
 import traceback
@@ -20,21 +19,58 @@ import curses
 
 log = logging.getLogger("STORY")
 
+story_enumerated = config.accessor("story.enumerated")
+taglist_border = config.accessor("taglist.border")
+taglist_wrap = config.accessor("taglist.wrap")
+
 class StoryPlugin(Plugin):
     pass
 
+# What a story that isn't counted contributes to its tag's counters, see
+# Story.recount and Tag.update_counts.
+
+NOT_COUNTED = (False, False, ())
+
+# Left, wrapped left, and right borders. These don't change, so every story
+# shares them instead of building its own.
+
+BORDERS = ("%C%B" + theme_border("ls") + "%b %c",\
+        "%C%B" + theme_border("ls") + "%b     %c",\
+        "%C %B" + theme_border("rs") + "%b%c")
+NO_BORDERS = ("%C %c", "%C     %c", "%C %c")
+WAITING_BORDERS = (" ", " ", " ")
+
 # The Story class is the basic wrapper for an item to be displayed. It manages
 # its own state only because it affects its representation, it's up to a higher
 # class to actually communicate state changes to the backend.
+#
+# There can be a lot of stories, so they're kept light. Our own attributes are
+# slotted, events (i.e. attribute updates) go to the parent Tag, which passes
+# them on, and plugins aren't instantiated until the story is first rendered.
+#
+# PluginHandler isn't slotted, so stories still have a __dict__, but it stays
+# empty until load_plugins puts the plugin state in it. See
+# tests/bench-stories.py to compare them with an older Story.
 
 class Story(PluginHandler):
-    def __init__(self, tag, id, callbacks):
-        PluginHandler.__init__(self)
+    __slots__ = [ "callbacks", "parent_tag", "is_dead", "id", "pad",\
+            "selected", "marked", "changed", "opt_gen", "width", "lns",\
+            "extra_lines", "pre_format", "post_format", "index",\
+            "enumerated", "rel_enumerated",\
+            "content", "new_content", "counted", "borders", "evald_string",\
+            "plugins_loaded", "curpos", "prev_obj", "next_obj", "prev_story",\
+            "next_story", "prev_sel", "next_sel" ]
+
+    is_tag = False
 
+    # Until load_plugins, lookups see no plugins.
+
+    plugin_attrs = {}
+
+    def __init__(self, tag, id, callbacks):
         self.callbacks = callbacks
 
         self.parent_tag = tag
-        self.is_tag = False
         self.is_dead = False
         self.id = id
         self.pad = None
@@ -45,10 +81,12 @@ class Story(PluginHandler):
         # Are there changes pending?
         self.changed = True
 
-        self.fresh_state = False
-        self.fresh_tags = False
+        # Generation of the options we last rendered with, see
+        # Tag.story_deps
+        self.opt_gen = 0
 
         self.width = 0
+        self.lns = 0
 
         # This is used by the rendering code.
         self.extra_lines = 0
@@ -57,31 +95,45 @@ class Story(PluginHandler):
         self.pre_format = ""
         self.post_format = ""
 
-        # Offset globally and in-tag.
-        self.offset = 0
-        self.rel_offset = 0
+        # Our place in our tag, set by Tag.sync. Offsets are derived from it.
+        self.index = 0
         self.enumerated = False
         self.rel_enumerated = False
 
-        # This should exist before the hook is setup, or the hook will fail.
-        self.content = {}
+        # Content is filled in by Tag.sync, which reads it once we can get
+        # updates, so that none are missed.
 
-        on_hook("curses_opt_change", self.on_opt_change, self)
-        on_hook("curses_tag_opt_change", self.on_tag_opt_change, self)
-        on_hook("curses_attributes", self.on_attributes, self)
+        self.content = None
+        self.new_content = None
 
-        # Grab initial content, if any, the rest will be handled by the
-        # attributes hook
+        # (unread, marked, user tags) as last added to our tag's counters.
+        # Tag.sync counts us in once we're part of the tag.
 
-        self.content = tag_updater.get_attributes(self.id)
-        self.new_content = None
+        self.counted = NOT_COUNTED
+
+        self.borders = WAITING_BORDERS
+        self.evald_string = ""
+
+        self.plugins_loaded = False
 
+        # Set by TagList when it maps the list.
+
+        self.curpos = 0
+        self.prev_obj = None
+        self.next_obj = None
+        self.prev_story = None
+        self.next_story = None
+        self.prev_sel = None
+        self.next_sel = None
+
+    def load_plugins(self):
+        PluginHandler.__init__(self)
         self.plugin_class = StoryPlugin
         self.update_plugin_lookups()
+        self.plugins_loaded = True
 
     def die(self):
         self.is_dead = True
-        unhook_all(self)
 
     def __eq__(self, other):
         if not other:
@@ -93,76 +145,87 @@ class Story(PluginHandler):
     def __str__(self):
         return "story: %s" % self.id
 
-    # On_attributes updates new_content. We don't lock because we don't
-    # particularly care what version of new_content the next sync() call gets.
-
-    def on_attributes(self, attributes):
-        if self.id in attributes:
-            new_content = attributes[self.id]
-
-            if not (new_content is self.content):
-                self.new_content = new_content
+    # Content is an immutable AttrRecord, so syncing is just taking the new
+    # record, unless we've already got a newer one from our own changes.
 
     def sync(self):
-        if self.new_content == None:
+        new_content = self.new_content
+        if new_content is None:
             return
 
-        old_content = self.content
-        self.content = self.new_content
         self.new_content = None
 
-        if 'canto-state' in old_content and self.fresh_state:
-            self.content['canto-state'] = old_content['canto-state']
-            self.fresh_state = False
+        if new_content.version <= self.content.version:
+            return
 
-        if 'canto-tags' in old_content and self.fresh_tags:
-            self.content['canto-tags'] = old_content['canto-tags']
-            self.fresh_tags = False
+        self.content = new_content
+        self.recount()
 
         self.need_redraw()
 
-    def on_opt_change(self, config):
-        if "taglist" in config and ("border" in config["taglist"] or "wrap" in config["taglist"]):
-            self.need_redraw()
+    # Add / remove state. Return True if an actual change, False otherwise.
 
-        if "color" in config or "style" in config:
-            self.need_redraw()
+    # Content is immutable (see AttributeStore), so we build a new list and
+    # record it as a local change.
 
-        if "story" not in config:
+    def _set_key(self, key, values):
+        self.content = tag_updater.change_attributes(self.id, { key : values })
+        self.recount()
+        self.need_redraw()
+
+    # Keep our tag's counters (see Tag.get_counts) in step with our content
+    # and marked state, so it never has to count its stories itself.
+
+    def recount(self):
+        if self.is_dead:
             return
 
-        if "format_attrs" in config["story"]:
-            needed_attrs = []
-            for attr in config["story"]["format_attrs"]:
-                if attr not in self.content:
-                    needed_attrs.append(attr)
-            if needed_attrs:
-                log.debug("%s needs: %s", self.id, needed_attrs)
-                tag_updater.need_attributes(self.id, needed_attrs)
+        content = self.content
 
-        # All other story options are formats / enumerations, redraw.
+        # Without canto-state we haven't got (or the AttributeStore has
+        # evicted) this story's attributes, so we don't know any better than
+        # what we counted last time. If we haven't been counted yet, we're
+        # unread until we hear otherwise.
 
-        self.need_redraw()
+        if "canto-state" not in content:
+            if self.counted is NOT_COUNTED:
+                unread, tags = True, ()
+            else:
+                unread, tags = self.counted[0], self.counted[2]
+        else:
+            unread = "read" not in content["canto-state"]
 
-    def on_tag_opt_change(self, config):
-        tagname = self.callbacks["get_tag_name"]()
-        if tagname in config and "enumerated" in config[tagname]:
-            self.need_redraw()
+            if "canto-tags" in content and content["canto-tags"]:
+                tags = tuple(content["canto-tags"])
+            else:
+                tags = ()
 
-    # Add / remove state. Return True if an actual change, False otherwise.
+        counted = (unread, self.marked, tags)
+        if counted != self.counted:
+            self.parent_tag.update_counts(self.counted, counted)
+            self.counted = counted
 
     def _handle_key(self, attr, key):
+
+        # Don't make up a value we haven't fetched, see TagList._fetched.
+
+        if key not in self.content and attr.lstrip("-%") != "marked":
+            tag_updater.want_attributes([ self.id ])
+            return False
+
         if key not in self.content or self.content[key] == "":
-            self.content[key] = []
+            values = []
+        else:
+            values = list(self.content[key])
 
         # Negative attribute
         if attr[0] == "-":
             attr = attr[1:]
             if attr == "marked":
                 return self.unmark()
-            elif attr in self.content[key]:
-                self.content[key].remove(attr)
-                self.need_redraw()
+            elif attr in values:
+                values.remove(attr)
+                self._set_key(key, values)
                 return True
 
         # Toggle attribute
@@ -174,20 +237,20 @@ class Story(PluginHandler):
                 else:
                     self.mark()
             else:
-                if attr in self.content[key]:
-                    self.content[key].remove(attr)
+                if attr in values:
+                    values.remove(attr)
                 else:
-                    self.content[key].append(attr)
-                self.need_redraw()
+                    values.append(attr)
+                self._set_key(key, values)
                 return True
 
         # Positive attribute
         else:
             if attr == "marked":
                 return self.mark()
-            elif attr not in self.content[key]:
-                self.content[key].append(attr)
-                self.need_redraw()
+            elif attr not in values:
+                values.append(attr)
+                self._set_key(key, values)
                 return True
         return False
 
@@ -197,14 +260,12 @@ class Story(PluginHandler):
     def handle_state(self, attr):
         r = self._handle_key(attr, "canto-state")
         if r:
-            self.fresh_state = True
             self.callbacks["item_state_change"](self)
         return r
 
     def handle_tag(self, tag):
         r = self._handle_key(tag, "canto-tags")
         if r:
-            self.fresh_tags = True
             self.callbacks["item_state_change"](self)
         return r
 
@@ -221,6 +282,7 @@ class Story(PluginHandler):
     def mark(self):
         if not self.marked:
             self.marked = True
+            self.recount()
             self.need_redraw()
             return True
         return False
@@ -228,25 +290,36 @@ class Story(PluginHandler):
     def unmark(self):
         if self.marked:
             self.marked = False
+            self.recount()
             self.need_redraw()
             return True
         return False
 
-    def set_offset(self, offset):
-        if self.offset != offset:
-            self.offset = offset
-            self.need_redraw()
+    # Offsets globally, in-tag, and among selectable items. These are derived
+    # from our tag's offsets (see TagList.update_tag_lists) and our index, so
+    # stories never have to be told when they move, and as the enumeration
+    # hints are drawn by TagList when it copies us to the screen (see
+    # enum_hint), moving doesn't mean redrawing either.
 
-    def set_rel_offset(self, offset):
-        if self.rel_offset != offset:
-            self.rel_offset = offset
-            self.need_redraw()
+    @property
+    def offset(self):
+        return self.parent_tag.item_offset + self.index
 
-    # This is not useful in the interface,
-    # so no redraw required on it.
+    @property
+    def rel_offset(self):
+        return self.index
 
-    def set_sel_offset(self, offset):
-        self.sel_offset = offset
+    @property
+    def sel_offset(self):
+        return self.parent_tag.sel_offset + self.index
+
+    def enum_hint(self):
+        header = ""
+        if self.enumerated:
+            header += cc("enum_hints") + "[" + str(self.offset) + "]%0"
+        if self.rel_enumerated:
+            header += cc("enum_hints") + "[" + str(self.rel_offset) + "]%0"
+        return header
 
     def need_redraw(self):
         self.changed = True
@@ -286,20 +359,29 @@ class Story(PluginHandler):
         return s
 
     def lines(self, width):
-        if width == self.width and not self.changed:
+        if not self.plugins_loaded:
+            self.load_plugins()
+
+        opt_gen = self.parent_tag.story_deps()
+
+        if width == self.width and not self.changed and opt_gen == self.opt_gen:
             return self.lns + self.extra_lines
 
+        self.opt_gen = opt_gen
+
         # Make sure we actually have all of the attributes needed
         # to complete the render.
 
-        self.enumerated = self.callbacks["get_opt"]("story.enumerated")
-        self.rel_enumerated = self.callbacks["get_tag_opt"]("enumerated")
+        self.enumerated = story_enumerated()
+        self.rel_enumerated = self.parent_tag.opt_enumerated()
 
         for attr in story_needed_attrs:
             if attr not in self.content:
 
                 # Not having needed info is a good reason to
-                # sync.
+                # sync, and to ask for it (lazy mode, or evicted).
+
+                tag_updater.want_attributes([ self.id ])
 
                 self.sync()
                 self.need_refresh()
@@ -307,9 +389,7 @@ class Story(PluginHandler):
 
                 log.debug("%s still needs %s", self, attr)
 
-                self.left = " "
-                self.left_more = " "
-                self.right = " "
+                self.borders = WAITING_BORDERS
 
                 self.evald_string = "Waiting on content..."
 
@@ -327,29 +407,24 @@ class Story(PluginHandler):
 
         self.evald_string = self.eval()
 
-        taglist_conf = self.callbacks["get_opt"]("taglist")
-
-        if taglist_conf["border"]:
-            self.left = "%C%B" + theme_border("ls") + "%b %c"
-            self.left_more = "%C%B" + theme_border("ls") + "%b     %c"
-            self.right = "%C %B" + theme_border("rs") + "%b%c"
+        if taglist_border():
+            self.borders = BORDERS
         else:
-            self.left = "%C %c"
-            self.left_more = "%C     %c"
-            self.right = "%C %c"
+            self.borders = NO_BORDERS
 
         self.pad = None
         self.width = width
         self.changed = False
 
         self.lns = self.render(FakePad(width), width)
-        if (not taglist_conf["wrap"]) and self.lns:
+        if (not taglist_wrap()) and self.lns:
             self.lns = 1
 
         return self.lns
 
     def pads(self, width):
-        if self.pad and not self.changed:
+        if self.pad and not self.changed and\
+                self.opt_gen == self.parent_tag.story_deps():
             return self.lns
 
         self.pad = curses.newpad(self.lines(width), width)
@@ -358,6 +433,7 @@ class Story(PluginHandler):
 
     def render(self, pad, width):
         s = self.evald_string
+        left, left_more, right = self.borders
 
         lines = 0
 
@@ -365,29 +441,13 @@ class Story(PluginHandler):
             while s:
                 # Left border, for first line
                 if lines == 0:
-                    l = self.left
+                    l = left
 
                 # Left border, for subsequent lines (indent)
                 else:
-                    l = self.left_more
+                    l = left_more
 
-                s = theme_print(pad, s, width, l, self.right)
-
-                # Handle overwriting with offset information
-
-                if lines == 0:
-                    header = ""
-                    if self.enumerated:
-                        header += cc("enum_hints") + "[" + str(self.offset) + "]%0"
-                    if self.rel_enumerated:
-                        header += cc("enum_hints") + "[" + str(self.rel_offset) + "]%0"
-                    if header:
-                        pad.move(0, 0)
-                        theme_print(pad, header, width, "","", False, False)
-                        try:
-                            pad.move(1, 0)
-                        except:
-                            pass
+                s = theme_print(pad, s, width, l, right)
 
                 lines += 1
 
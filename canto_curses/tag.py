@@ -12,13 +12,15 @@ from canto_next.rwlock import read_lock
 
 from .locks import sync_lock, config_lock
 from .theme import FakePad, WrapPad, theme_print, theme_reset, theme_border, prep_for_display
-from .config import config
-from .story import Story
+from .config import config, tag_opt_path
+from .tagcore import tag_updater, diff_ids
+from .story import Story, NOT_COUNTED
 from .color import cc
 
 import traceback
 import logging
 import curses
+import time
 
 log = logging.getLogger("TAG")
 
@@ -33,6 +35,38 @@ class TagPlugin(Plugin):
 
 alltags = []
 
+taglist_border = config.accessor("taglist.border")
+taglist_tags_enumerated = config.accessor("taglist.tags_enumerated")
+taglist_tags_enumerated_absolute = config.accessor("taglist.tags_enumerated_absolute")
+update_style = config.accessor("update.style")
+
+# Options that affect how tags and stories are rendered. Each Tag adds its own
+# tag options to these, see Tag.deps and Tag.story_deps
+
+tag_opt_paths = [ "taglist.tags_enumerated", "taglist.tags_enumerated_absolute",\
+        "taglist.border", "tagobj", "color", "style" ]
+
+story_opt_paths = [ "story", "taglist.border", "taglist.wrap", "color", "style" ]
+
+# Stories made between checks of a sync deadline.
+
+SYNC_CHUNK = 256
+
+# A Tag.sync in progress. Order is our new list of stories, with the IDs of
+# the ones yet to be made in their places, and pending holds their indices, in
+# the order they'll be made, to be worked through from cursor. View is the
+# story pending was last ordered around (see Tag.prioritize_sync).
+
+class SyncPlan(object):
+    __slots__ = [ "order", "pending", "cursor", "old_stories", "view" ]
+
+    def __init__(self, order, pending, old_stories):
+        self.order = order
+        self.pending = pending
+        self.cursor = 0
+        self.old_stories = old_stories
+        self.view = None
+
 class Tag(PluginHandler, list):
     def __init__(self, tagcore, callbacks):
         list.__init__(self)
@@ -40,6 +74,17 @@ class Tag(PluginHandler, list):
 
         self.tagcore = tagcore
         self.tag = tagcore.tag
+
+        # id -> Story, kept in step with our list by sync()
+        self.stories = {}
+
+        # SyncPlan, while a sync is in progress
+        self.sync_plan = None
+
+        # The first of our stories on screen, set by TagList, so that a sync
+        # makes the stories around it first.
+        self.view_story = None
+
         self.is_tag = True
         self.updates_pending = 0
 
@@ -61,6 +106,16 @@ class Tag(PluginHandler, list):
                 lambda x, y : callbacks["set_tag_opt"](self.tag, x, y)
         self.callbacks["get_tag_name"] = lambda : self.tag
 
+        # Accessors for our own tag options, shared with our stories.
+
+        self.opt_collapsed = config.tag_accessor(self.tag, "collapsed")
+        self.opt_enumerated = config.tag_accessor(self.tag, "enumerated")
+
+        self.deps = config.deps(tag_opt_paths + [ "tags." + self.tag ])
+        self.story_deps = config.deps(story_opt_paths +\
+                [ tag_opt_path(self.tag, "enumerated") ])
+        self.opt_gen = 0
+
         # This could be implemented as a generic, top-level hook but then N
         # tags would have access to story objects they shouldn't have and
         # would have to check every items membership in self, which would be
@@ -89,15 +144,19 @@ class Tag(PluginHandler, list):
         self.pre_format = ""
         self.post_format = ""
 
+        # Counters kept up to date by our stories (see Story.recount), so
+        # rendering the header doesn't have to look at every story.
+
+        self.unread = 0
+        self.marked_stories = 0
+        self.user_tags = {}
+
         # Global indices (for enumeration)
         self.item_offset = -1
         self.visible_tag_offset = -1
         self.tag_offset = -1
         self.sel_offset = -1
 
-        on_hook("curses_opt_change", self.on_opt_change, self)
-        on_hook("curses_tag_opt_change", self.on_tag_opt_change, self)
-        on_hook("curses_attributes", self.on_attributes, self)
         on_hook("curses_items_added", self.on_items_added, self)
 
         # Upon creation, this Tag adds itself to the
@@ -113,9 +172,20 @@ class Tag(PluginHandler, list):
         # Reset so items get die() called and everything
         # else is notified about items disappearing.
 
-        for s in self:
+        # Stories includes any made by a sync in progress.
+
+        tag_updater.unsubscribe(list(self.stories.keys()),\
+                self.on_story_attributes)
+
+        for s in self.stories.values():
             s.die()
         del self[:]
+        self.stories = {}
+        self.sync_plan = None
+
+        self.unread = 0
+        self.marked_stories = 0
+        self.user_tags = {}
 
         alltags.remove(self)
 
@@ -124,42 +194,20 @@ class Tag(PluginHandler, list):
     def on_item_state_change(self, item):
         self.need_redraw()
 
-    def on_opt_change(self, opts):
-        if "taglist" in opts and\
-                ("tags_enumerated" in opts["taglist"] or\
-                "tags_enumerated_absolute" in opts["taglist"] or\
-                "border" in opts["taglist"]):
-            self.need_redraw()
+    # Attribute updates for our stories (see TagUpdater.subscribe). We don't
+    # lock because we don't particularly care what version of new_content the
+    # story's next sync() call gets.
 
-        if "tagobj" in opts:
+    def on_story_attributes(self, record):
+        story = self.stories.get(record.id)
+        if story is not None:
+            story.new_content = record
             self.need_redraw()
 
-        if "color" in opts or "style" in opts:
-            self.need_redraw()
-
-    def on_tag_opt_change(self, opts):
-        if self.tag in list(opts.keys()):
-            tc = opts[self.tag]
-            if "collapsed" in tc:
-                self.need_refresh()
-            else:
-                self.need_redraw()
-
-    # Technically, we might want to hold sync_lock so that self[:] doesn't
-    # change, but if we're syncing, the setting of needs_redraw isn't important
-    # anymore, and if we're not, there's no issue.
-
-    def on_attributes(self, attributes):
-        for s in self:
-            if s.id in attributes:
-                self.need_redraw()
-                break
-
     def on_items_added(self, tagcore, added):
         if tagcore == self.tagcore:
-            cur_ids = self.get_ids()
             for story_id in added:
-                if story_id not in cur_ids:
+                if story_id not in self.stories:
                     self.updates_pending += 1
             self.need_redraw()
 
@@ -175,37 +223,53 @@ class Tag(PluginHandler, list):
         return "%s" % self.tag[self.tag.index(':') + 1:]
 
     def get_id(self, id):
-        for item in self:
-            if item.id == id:
-                return item
+        return self.stories.get(id)
 
     def get_ids(self):
         return [ s.id for s in self ]
 
-    # Inform the tag of global index of it's first item.
-    def set_item_offset(self, offset):
-        if self.item_offset != offset:
-            self.item_offset = offset
-            for i, item in enumerate(self):
-                item.set_offset(offset + i)
+    # Move a story's contribution to our counters from old to new, both
+    # (unread, marked, user tags) tuples from Story.recount.
+
+    def update_counts(self, old, new):
+        self.unread += new[0] - old[0]
+        self.marked_stories += new[1] - old[1]
+
+        user_tags = self.user_tags
+        for tag in old[2]:
+            if user_tags[tag] == 1:
+                del user_tags[tag]
+            else:
+                user_tags[tag] -= 1
+        for tag in new[2]:
+            user_tags[tag] = user_tags.get(tag, 0) + 1
+
+        self.changed = True
+
+    # Public interface for themes and plugins, these are kept current without
+    # counting, so they're cheap enough to call on every render.
+
+    def get_counts(self):
+        return { "total" : len(self), "unread" : self.unread,\
+                "read" : len(self) - self.unread,\
+                "marked" : self.marked_stories,\
+                "pending" : self.updates_pending }
+
+    # Number of our stories with each user tag (canto-tags entry).
 
-    # Note that this cannot be short-cut (i.e.
-    # copout if sel_offset is already equal)
-    # because it's possible that it's the same
-    # without the items having ever been updated.
+    def get_user_tag_counts(self):
+        return self.user_tags.copy()
 
-    # Alternatively, we could reset them in
-    # on_tag_opt_change, but since the sel
-    # offset does not cause a redraw, there's
-    # no point.
+    # Inform the tag of global index of it's first item, and first selectable
+    # item. Our stories derive their own offsets from these (see Story.offset)
+    # so there's nothing else to update.
+
+    def set_item_offset(self, offset):
+        self.item_offset = offset
 
     def set_sel_offset(self, offset):
         self.sel_offset = offset
 
-        if not self.callbacks["get_tag_opt"]("collapsed"):
-            for i, item in enumerate(self):
-                item.set_sel_offset(offset + i)
-
     def set_visible_tag_offset(self, offset):
         if self.visible_tag_offset != offset:
             self.visible_tag_offset = offset
@@ -238,9 +302,7 @@ class Tag(PluginHandler, list):
         # Make sure to strip out the category from category:name
         tag = self.tag.split(':', 1)[1]
 
-        unread = len([s for s in self\
-                if "canto-state" not in s.content or\
-                "read" not in s.content["canto-state"]])
+        unread = self.unread
 
         s = ""
         if self.selected:
@@ -263,17 +325,17 @@ class Tag(PluginHandler, list):
         return s
 
     def lines(self, width):
-        if width == self.width and not self.changed:
-            return self.lns
+        opt_gen = self.deps()
 
-        taglist_conf = self.callbacks["get_opt"]("taglist")
+        if width == self.width and not self.changed and opt_gen == self.opt_gen:
+            return self.lns
 
-        self.collapsed = self.callbacks["get_tag_opt"]("collapsed")
-        self.border = taglist_conf["border"]
-        self.enumerated = taglist_conf["tags_enumerated"]
-        self.abs_enumerated = taglist_conf["tags_enumerated_absolute"]
+        self.opt_gen = opt_gen
 
-        extra_tags = self.callbacks["get_tag_conf"](self.tag)['extra_tags']
+        self.collapsed = self.opt_collapsed()
+        self.border = taglist_border()
+        self.enumerated = taglist_tags_enumerated()
+        self.abs_enumerated = taglist_tags_enumerated_absolute()
 
         self.pad = None
         self.footpad = None
@@ -288,7 +350,8 @@ class Tag(PluginHandler, list):
         return self.lns
 
     def pads(self, width):
-        if self.pad and (self.footpad or not self.footlines) and not self.changed:
+        if self.pad and (self.footpad or not self.footlines) and\
+                not self.changed and self.opt_gen == self.deps():
             return self.lns
 
         self.pad = curses.newpad(self.lines(width), width)
@@ -343,90 +406,185 @@ class Tag(PluginHandler, list):
             return 1
         return 0
 
-    # Synchronize this Tag with its TagCore
+    # Synchronize this Tag with its TagCore.
+    #
+    # Making Story objects for a huge tag can take a while, so with a deadline
+    # (from time.time()) we stop once it's passed and return False, to be
+    # called again to pick up where we left off (see run_gui). Otherwise, or
+    # once we're done, we return True.
 
-    def sync(self, force=False):
-        if force or self.tagcore.changes:
-            sel = self.callbacks["get_var"]("selected")
+    def sync(self, force=False, deadline=None):
+        if not self.sync_plan and (force or self.tagcore.changes):
+            self.sync_plan = self.plan_sync()
 
-            self.tagcore.lock.acquire_read()
+        plan = self.sync_plan
+        if plan:
+            self.prioritize_sync(plan)
 
-            self.tagcore.ack_changes()
+            pending = plan.pending
+            while plan.cursor < len(pending):
+                chunk = pending[plan.cursor:plan.cursor + SYNC_CHUNK]
+                plan.cursor += len(chunk)
+                self.create_stories(plan, chunk)
 
-            # Get sorted ids, along with their (unsorted) positions in the
-            # original lists.
+                if deadline and time.time() >= deadline:
+                    break
 
-            sorted_ids = [ (x, x.id, i) for (i, x) in enumerate(self) ]
-            sorted_ids.sort(key=lambda x: x[1])
+            if plan.cursor < len(pending):
 
-            tagcore_sorted_ids = list(enumerate(self.tagcore))
-            tagcore_sorted_ids.sort(key=lambda x: x[1])
+                # Show what we have made so far while we work on the rest.
 
-            new_ids = []
-            current_stories = []
-            old_stories = []
+                self.install_stories(plan)
+                return False
 
-            for story, s_id, place in sorted_ids:
-                while tagcore_sorted_ids and s_id > tagcore_sorted_ids[0][1]:
-                    new_ids.append(tagcore_sorted_ids.pop(0))
+            self.install_stories(plan)
+            self.sync_plan = None
 
-                if not tagcore_sorted_ids or s_id < tagcore_sorted_ids[0][1]:
-                    if sel and (not sel.is_tag) and (s_id == sel.id):
+        # Pass the sync onto story objects
+        for s in self:
+            s.sync()
+
+        self.updates_pending = 0
+        return True
+
+    # Diff our stories against the tagcore and work out our new list, with
+    # the IDs of stories we have yet to make standing in for them.
 
-                        # If we preserve the selection in an "undead" state, then
-                        # we keep set tagcore changed so that the next sync operation
-                        # will re-evaluate it.
+    def plan_sync(self):
+        sel = self.callbacks["get_var"]("selected")
 
-                        self.tagcore.changed()
-                        place = -1
-                        current_stories.append((place, story))
-                    else:
-                        old_stories.append(story)
-                else:
-                    place = tagcore_sorted_ids.pop(0)[0]
-                    current_stories.append((place, story))
+        self.tagcore.lock.acquire_read()
 
-            # Grab any remaining new items
-            new_ids += tagcore_sorted_ids
+        self.tagcore.ack_changes()
 
-            self.tagcore.lock.release_read()
+        added, kept, removed = diff_ids(self.get_ids(), self.tagcore,\
+                self.stories, self.tagcore.positions)
 
-            new_stories = [ (p, Story(self, x, self.callbacks)) for (p, x) in new_ids ]
+        current_stories = [ (place, self[i]) for (i, place) in kept ]
+        old_stories = []
 
-            call_hook("curses_stories_added", [ self, [ x for (p, x) in new_stories ]])
+        for i in removed:
+            story = self[i]
+            if sel and (not sel.is_tag) and (story.id == sel.id):
 
-            del self[:]
+                # If we preserve the selection in an "undead" state, then
+                # we keep set tagcore changed so that the next sync operation
+                # will re-evaluate it.
 
-            conf = config.get_conf()
-            if conf["update"]["style"] == "maintain" or self.tagcore.was_reset:
-                self.tagcore.was_reset = False
-                current_stories += new_stories
-                current_stories.sort()
-                self.extend([ x[1] for x in current_stories ])
+                self.tagcore.changed()
+                current_stories.append((-1, story))
+            else:
+                old_stories.append(story)
+
+        new_ids = [ (i, self.tagcore[i]) for i in added ]
+
+        self.tagcore.lock.release_read()
+
+        by_place = lambda x : x[0]
+
+        style = update_style()
+        if style == "maintain" or self.tagcore.was_reset:
+            self.tagcore.was_reset = False
+            entries = current_stories + new_ids
+            entries.sort(key=by_place)
+        else:
+            current_stories.sort(key=by_place)
+            if style == "append":
+                entries = current_stories + new_ids
             else:
-                current_stories.sort()
-                new_stories.sort()
-                if conf["update"]["style"] == "append":
-                    current_stories += new_stories
-                    self.extend([ x[1] for x in current_stories ])
-                else:
-                    new_stories += current_stories
-                    self.extend([ x[1] for x in new_stories ])
+                entries = new_ids + current_stories
+
+        order = [ x for (p, x) in entries ]
+        pending = [ i for (i, x) in enumerate(order) if not isinstance(x, Story) ]
+
+        return SyncPlan(order, pending, old_stories)
+
+    # Make the stories on screen, and then the ones following and preceding
+    # them, before the rest. Called before each slice, since the view can move
+    # between them.
+
+    def prioritize_sync(self, plan):
+        story = self.view_story
+        if story is None or story is plan.view:
+            return
+        plan.view = story
+
+        # By identity, see Story.__eq__
+
+        for p, x in enumerate(plan.order):
+            if x is story:
+                break
+        else:
+            return
+
+        left = plan.pending[plan.cursor:]
+        after = [ i for i in left if i >= p ]
+        before = [ i for i in left if i < p ]
+        before.reverse()
+
+        plan.pending[plan.cursor:] = after + before
+
+    # Make the stories for these indices into plan.order.
+
+    def create_stories(self, plan, chunk):
+        order = plan.order
+        ids = [ order[i] for i in chunk ]
+
+        stories = [ Story(self, id, self.callbacks) for id in ids ]
+
+        # Make new stories reachable by on_story_attributes and subscribe
+        # before reading their content, so no update can fall in between.
+
+        for story in stories:
+            self.stories[story.id] = story
+
+        tag_updater.subscribe(ids, self.on_story_attributes)
+
+        # They're counted when they're installed, see install_stories.
+
+        for story, record in zip(stories, tag_updater.get_all_attributes(ids)):
+            story.content = record
+
+        for i, story in zip(chunk, stories):
+            order[i] = story
+
+        call_hook("curses_stories_added", [ self, stories ])
+
+    # Replace our list with the stories made so far, and get rid of the ones
+    # that aren't in the tag anymore (the first time around). Only the stories
+    # in our list count towards our counters, so they agree with len(self)
+    # mid-sync.
+
+    def install_stories(self, plan):
+        self[:] = [ x for x in plan.order if isinstance(x, Story) ]
+
+        for i, story in enumerate(self):
+            story.index = i
+            if story.counted is NOT_COUNTED:
+                story.recount()
+
+        # New stories are added to self.stories as they're made, so it only
+        # needs rebuilding to drop the old ones.
+
+        old_stories = plan.old_stories
+        if old_stories is not None:
+            plan.old_stories = None
+
+            self.stories = dict((s.id, s) for s in self)
+
+            tag_updater.unsubscribe([ s.id for s in old_stories ],\
+                    self.on_story_attributes)
 
             for story in old_stories:
+                self.update_counts(story.counted, NOT_COUNTED)
+                story.counted = NOT_COUNTED
                 story.die()
 
             # Properly dispose of the remaining stories
 
             call_hook("curses_stories_removed", [ self, old_stories ])
 
-            # Trigger a refresh so that classes above (i.e. TagList) will remap
-            # items
-
-            self.need_refresh()
+        # Trigger a refresh so that classes above (i.e. TagList) will remap
+        # items
 
-        # Pass the sync onto story objects
-        for s in self:
-            s.sync()
-
-        self.updates_pending = 0
+        self.need_refresh()
@@ -6,20 +6,62 @@
 #   it under the terms of the GNU General Public License version 2 as 
 #   published by the Free Software Foundation.
 
-from canto_next.rwlock import RWLock
+from canto_next.rwlock import RWLock, write_lock
 from canto_next.hooks import call_hook, on_hook
 
+from .attrstore import AttributeStore
+from .cache import ItemCache
 from .subthread import SubThread
-from .locks import config_lock
+from .locks import config_lock, lane_lock
 from .config import config, story_needed_attrs
 
+from collections import deque
 import traceback
 import logging
+import time
+import os
 
 log = logging.getLogger("TAGCORE")
 
 alltagcores = []
 
+# The most IDs we'll ask for in a single ATTRIBUTES message.
+
+ATTRIBUTES_BATCH = 500
+
+update_lazy_fill = config.accessor("update.lazy.fill")
+
+# Diff two lists of IDs, returning indices so that callers can carry along
+# whatever is associated with each ID (i.e. Tag.sync with Story objects).
+#
+# added   - indices into new of IDs that aren't in old, in new order
+# kept    - (old index, new index) of IDs in both, in old order
+# removed - indices into old of IDs that aren't in new, in old order
+#
+# This is linear in the size of the lists, which matters because the daemon
+# sends the full list of IDs for a tag on every update. Callers that already
+# index their IDs (i.e. TagCore.positions) can pass those in to save building
+# them again.
+
+def diff_ids(old, new, old_ids=None, new_places=None):
+    if new_places is None:
+        new_places = dict((id, i) for (i, id) in enumerate(new))
+    if old_ids is None:
+        old_ids = set(old)
+
+    kept = []
+    removed = []
+
+    for i, id in enumerate(old):
+        if id in new_places:
+            kept.append((i, new_places[id]))
+        else:
+            removed.append(i)
+
+    added = [ i for (i, id) in enumerate(new) if id not in old_ids ]
+
+    return added, kept, removed
+
 class TagCore(list):
     def __init__(self, tag):
         list.__init__(self)
@@ -28,6 +70,11 @@ class TagCore(list):
         self.changes = False
         self.was_reset = False
 
+        # id -> position in the list, so that membership (i.e. deltas,
+        # on_stories_removed) and position lookups don't search the list.
+
+        self.positions = {}
+
         self.lock = RWLock("lock: %s" % tag)
         alltagcores.append(self)
 
@@ -39,24 +86,160 @@ class TagCore(list):
     def changed(self):
         self.changes = True
 
+    def __contains__(self, id):
+        return id in self.positions
+
+    # Position of id in the tag, or None if it's not in it.
+
+    def position(self, id):
+        return self.positions.get(id)
+
     def set_items(self, ids):
         self.lock.acquire_write()
 
         del self[:]
         self.extend(ids)
+        self.positions = dict((id, i) for (i, id) in enumerate(ids))
         self.changed()
 
         self.lock.release_write()
 
-class TagUpdater(SubThread):
+    # Apply an incremental ITEMS update. Added IDs go on the end, in order.
+    # Returns the IDs actually added and removed.
+
+    def apply_delta(self, add, remove):
+        self.lock.acquire_write()
+
+        positions = self.positions
+
+        removed = [ id for id in remove if id in positions ]
+        if removed:
+
+            # Every position after the first removed ID shifts, so it's no
+            # more work to rebuild from there than to fix them up.
+
+            first = min([ positions[id] for id in removed ])
+            for id in removed:
+                del positions[id]
+
+            self[first:] = [ id for id in self[first:] if id in positions ]
+            for i in range(first, len(self)):
+                positions[self[i]] = i
+
+        added = []
+        for id in add:
+            if id not in positions:
+                positions[id] = len(self) + len(added)
+                added.append(id)
+        self.extend(added)
+
+        if added or removed:
+            self.changed()
+
+        self.lock.release_write()
+
+        return added, removed
+
+# A TagLane is an extra connection to the daemon that ITEMS requests for some
+# tags are sent over, so that a huge tag doesn't hold up the rest behind it.
+# Responses are handed back to the TagUpdater.
+
+class TagLane(SubThread):
+    def __init__(self, updater):
+        self.updater = updater
+        self.items_queue = deque()
+
     def init(self, backend):
         SubThread.init(self, backend)
+        self.start_pthread()
+
+    def prot_items(self, updates):
+        self.updater.prot_items(updates)
+
+    def prot_itemsdone(self, tag):
+        self.updater.items_done(self)
+
+    def prot_attributes(self, d):
+        self.updater.prot_attributes(d)
+
+class TagUpdater(SubThread):
 
+    # State that the GUI can touch (i.e. flush_attributes after every pass)
+    # is set up here, rather than in init(), as the GUI starts before we're
+    # connected.
+
+    def __init__(self):
         self.updating = []
 
-        self.attributes = {}
+        # With update.connections set, lanes[0] is reserved for tags that are
+        # on screen (priority_tags), and other tags are spread over the rest,
+        # or our own connection if there's only one.
+
+        self.lanes = []
+        self.priority_tags = set()
+
+        # A tag's lane depends on its priority, which can change while it's
+        # waiting on ITEMS. So that an old response on one connection can't
+        # land after a newer one on another, a tag sticks to its lane while
+        # it has requests outstanding: tag -> (lane, outstanding). Each
+        # connection's items_queue holds the tags it was asked for, in order,
+        # to be matched up with ITEMSDONE (see items_done).
+
+        self.items_lanes = {}
+        self.items_queue = deque()
+
+        self.attributes = AttributeStore()
         self.lock = RWLock("tagupdater")
 
+        # id -> [ callbacks ] for the tags holding that id, so attribute
+        # updates only go to the stories that care (see subscribe).
+
+        self.subscribers = {}
+
+        # Attribute requests are queued up and sent together by
+        # flush_attributes. Both map id -> list of attributes, or None for all
+        # attributes.
+
+        self.pending_attrs = {}
+        self.inflight_attrs = {}
+        self.autoattr_pending = False
+
+        # In lazy mode (update.lazy.enabled) we don't have the daemon send
+        # attributes automatically. Stories ask for theirs when they're about
+        # to be on screen (want_attributes), and fill_attributes picks up the
+        # rest, in the order they arrived, when we're idle.
+
+        self.lazy = False
+        self.unfetched = {}
+
+        # With update.cache.persist, prime TagCores and attributes from what
+        # we had last time we exited (see ItemCache).
+
+        self.cache = None
+        self.cached_tags = {}
+
+        # IDs whose attributes came from the cache, and that we haven't heard
+        # about from the daemon since. In lazy mode nothing would ask for them
+        # again, so they're fetched once like any other (see want_attributes).
+
+        self.stale = {}
+
+    def init(self, backend):
+        SubThread.init(self, backend)
+
+        for i in range(config.get_opt("update.connections")):
+            lane = TagLane(self)
+            lane.init(backend)
+            self.lanes.append(lane)
+
+        self.lazy = config.get_opt("update.lazy.enabled")
+
+        self.set_budget()
+
+        if config.get_opt("update.cache.persist") and hasattr(backend, "conf_dir"):
+            self.load_cache(os.path.join(backend.conf_dir, "curses-cache.db"),\
+                    str(backend.location_args))
+
         self.start_pthread()
 
         # Setup automatic attributes.
@@ -73,7 +256,7 @@ class TagUpdater(SubThread):
                 if sa not in self.needed_attrs:
                     self.needed_attrs.append(sa)
 
-        self.write("AUTOATTR", self.needed_attrs)
+        self.write_all("AUTOATTR", self.autoattr())
 
         # Lock config_lock so that strtags doesn't change and we miss
         # tags.
@@ -92,13 +275,162 @@ class TagUpdater(SubThread):
         on_hook("curses_del_tag", self.on_del_tag)
         on_hook("curses_stories_removed", self.on_stories_removed)
         on_hook("curses_def_opt_change", self.on_def_opt_change)
+        on_hook("curses_opt_change", self.on_opt_change)
 
         config_lock.release_read()
 
+    # AUTOATTR is per connection, so every lane needs to know.
+
+    def write_all(self, cmd, args):
+        self.write(cmd, args)
+        for lane in self.lanes:
+            lane.write(cmd, args)
+
+    def lane_for(self, tag):
+        if not self.lanes:
+            return self
+        if tag in self.priority_tags:
+            return self.lanes[0]
+        if len(self.lanes) == 1:
+            return self
+        return self.lanes[1 + hash(tag) % (len(self.lanes) - 1)]
+
+    def write_items(self, tag):
+        self.lock.acquire_write()
+
+        if tag in self.items_lanes:
+            lane, outstanding = self.items_lanes[tag]
+        else:
+            lane, outstanding = self.lane_for(tag), 0
+
+        self.items_lanes[tag] = (lane, outstanding + 1)
+        lane.items_queue.append(tag)
+        lane.write("ITEMS", [ tag ])
+
+        self.lock.release_write()
+
+    # ITEMSDONE ends the response to the oldest ITEMS sent over lane.
+
+    def items_done(self, lane):
+        self.lock.acquire_write()
+
+        if lane.items_queue:
+            tag = lane.items_queue.popleft()
+            lane, outstanding = self.items_lanes[tag]
+            if outstanding == 1:
+                del self.items_lanes[tag]
+            else:
+                self.items_lanes[tag] = (lane, outstanding - 1)
+
+        self.lock.release_write()
+
+    # Tags on screen, or selected. Their ITEMS go over the priority lane.
+
+    def set_priority_tags(self, tags):
+        self.priority_tags = set(tags)
+
+    def autoattr(self):
+        if self.lazy:
+            return []
+        return self.needed_attrs
+
+    def set_budget(self):
+        self.lock.acquire_write()
+        self.attributes.budget = config.get_opt("update.cache.budget") * 1024 * 1024
+        self.lock.release_write()
+
+    def on_opt_change(self, opts):
+        if "update" in opts and "cache" in opts["update"]:
+            self.set_budget()
+
+        if "update" in opts and "lazy" in opts["update"] and\
+                "enabled" in opts["update"]["lazy"]:
+            self.lock.acquire_write()
+            self.lazy = config.get_opt("update.lazy.enabled")
+            self.autoattr_pending = True
+
+            # Anything we have IDs for, but not attributes, is fair game for
+            # fill_attributes. Otherwise, AUTOATTR will take care of new items.
+
+            self.unfetched = {}
+            if self.lazy:
+                for tagcore in alltagcores:
+                    for id in tagcore:
+                        if id not in self.attributes or id in self.stale:
+                            self.unfetched[id] = True
+            self.lock.release_write()
+
+            self.flush_attributes()
+
+    def load_cache(self, path, location):
+        self.cache = ItemCache(path, location)
+        if not self.cache.open():
+            self.cache = None
+            return
+
+        start = time.time()
+
+        self.cached_tags, cached_attrs = self.cache.load()
+
+        self.lock.acquire_write()
+        for id, attrs in cached_attrs.items():
+            self.attributes.update(id, attrs)
+            self.stale[id] = True
+            if self.lazy:
+                self.unfetched[id] = True
+        self.lock.release_write()
+
+        log.info("Loaded %d tags, %d stories from cache in %.3fs",\
+                len(self.cached_tags), len(cached_attrs), time.time() - start)
+
+    # Save our tags, and the needed attributes of their stories, for next
+    # startup.
+
+    def save_cache(self):
+        if not self.cache:
+            return
+
+        start = time.time()
+
+        tags = {}
+        for tagcore in alltagcores:
+            tagcore.lock.acquire_read()
+            tags[tagcore.tag] = list(tagcore)
+            tagcore.lock.release_read()
+
+        attributes = {}
+
+        self.lock.acquire_read()
+        for ids in tags.values():
+            for id in ids:
+                record = self.attributes.get(id)
+                if record is None or id in attributes:
+                    continue
+                attributes[id] = dict([ (attr, record[attr]) for attr in\
+                        self.needed_attrs if attr in record ])
+        self.lock.release_read()
+
+        self.cache.save(tags, attributes)
+        self.cache.close()
+
+        log.info("Saved %d tags, %d stories to cache in %.3fs",\
+                len(tags), len(attributes), time.time() - start)
+
     def on_new_tag(self, tag):
+
+        # Create the TagCore (primed from the cache) before asking for ITEMS,
+        # under lane_lock, so the daemon's response can't arrive before it, or
+        # be overwritten by the cached list.
+
+        lane_lock.acquire_write()
+        tagcore = TagCore(tag)
+        if tag in self.cached_tags:
+            tagcore.set_items(self.cached_tags.pop(tag))
+        lane_lock.release_write()
+
         self.write("WATCHTAGS", [ tag ])
         self.prot_tagchange(tag)
-        call_hook("curses_new_tagcore", [ TagCore(tag) ])
+        call_hook("curses_new_tagcore", [ tagcore ])
 
     def on_del_tag(self, tag):
         for tagcore in alltagcores[:]:
@@ -122,13 +454,23 @@ class TagUpdater(SubThread):
         else:
             log.warn("Couldn't find tagcore for removed story tag %s" % tag.tag)
 
+        if tagcore:
+            present = tagcore
+        else:
+            present = ()
+
         self.lock.acquire_write()
         for item in items:
-            if tagcore and item.id in tc:
+            if item.id in present:
                 log.debug("%s still in tagcore, not removing", item.id)
                 continue
-            if item.id in self.attributes:
-                del self.attributes[item.id]
+            self.attributes.remove(item.id)
+            if item.id in self.inflight_attrs:
+                del self.inflight_attrs[item.id]
+            if item.id in self.unfetched:
+                del self.unfetched[item.id]
+            if item.id in self.stale:
+                del self.stale[item.id]
         self.lock.release_write()
 
     # Changes to global filters should force a full refresh.
@@ -138,25 +480,37 @@ class TagUpdater(SubThread):
             log.debug("global_transform changed, forcing reset + update")
             self.update()
 
+    @write_lock(lane_lock)
     def prot_attributes(self, d):
-        # Update attributes, and then notify everyone to grab new content.
+        # Update attributes, and then notify everyone with the updated IDs to
+        # grab new content.
+
         self.lock.acquire_write()
 
+        updated = {}
         for key in d.keys():
-            if key in self.attributes:
-
-                # If we're updating, we want to create a whole new dict object
-                # so that our stories dicts don't get updated without a sync
+            updated[key] = self.attributes.update(key, d[key])
+            if key in self.inflight_attrs:
+                del self.inflight_attrs[key]
+            if key in self.unfetched:
+                del self.unfetched[key]
+            if key in self.stale:
+                del self.stale[key]
+
+        # If we're over budget, evicted IDs get an empty record, so their
+        # stories drop the old one on sync and ask again if they're drawn.
+
+        evicted = self.attributes.evict()
+        if evicted:
+            updated.update(evicted)
+            log.debug("Evicted %d attribute records: %s", len(evicted),\
+                    self.attributes.stats())
 
-                cp = self.attributes[key].copy()
-                cp.update(d[key])
-                self.attributes[key] = cp
-            else:
-                self.attributes[key] = d[key]
         self.lock.release_write()
 
-        call_hook("curses_attributes", [ self.attributes ])
+        self.dispatch_attributes(updated)
 
+    @write_lock(lane_lock)
     def prot_items(self, updates):
         # Daemon should now only return with one tag in an items response
 
@@ -168,34 +522,33 @@ class TagUpdater(SubThread):
         else:
             return
 
-        sorted_updated_ids = list(enumerate(updates[tag]))
-        sorted_updated_ids.sort(key=lambda x : x[1])
-
-        sorted_current_ids = list(enumerate(have_tag))
-        sorted_current_ids.sort(key=lambda x : x[1])
-
-        new_ids = []
-        cur_ids = []
-        old_ids = []
+        updated_ids = updates[tag]
 
-        for c_place, c_id in sorted_current_ids:
-            while sorted_updated_ids and c_id > sorted_updated_ids[0][1]:
-                new_ids.append(sorted_updated_ids.pop(0))
+        # The daemon can either send the full list of IDs, or a delta like
+        # { "add" : [ new IDs ], "remove" : [ old IDs ] }, which we can apply
+        # without looking at the rest of the tag.
 
-            if not sorted_updated_ids or c_id < sorted_updated_ids[0][1]:
-                old_ids.append(c_id)
-            else:
-                cur_ids.append(sorted_updated_ids.pop(0))
+        if type(updated_ids) == dict:
+            new_ids, old_ids = have_tag.apply_delta(updated_ids.get("add", []),\
+                    updated_ids.get("remove", []))
+        else:
+            added, kept, removed = diff_ids(have_tag, updated_ids,\
+                    have_tag.positions)
 
-        new_ids += sorted_updated_ids
+            old_ids = [ have_tag[i] for i in removed ]
+            new_ids = [ updated_ids[i] for i in added ]
 
-        all_ids = new_ids + cur_ids
-        all_ids.sort()
+            have_tag.set_items(updated_ids)
 
-        have_tag.set_items([x[1] for x in all_ids])
+        if self.lazy and new_ids:
+            self.lock.acquire_write()
+            for id in new_ids:
+                if id not in self.attributes or id in self.stale:
+                    self.unfetched[id] = True
+            self.lock.release_write()
 
         if new_ids:
-            call_hook("curses_items_added", [ have_tag, [x[1] for x in new_ids] ] )
+            call_hook("curses_items_added", [ have_tag, new_ids ] )
 
         if old_ids:
             call_hook("curses_items_removed", [ have_tag, old_ids ] )
@@ -208,10 +561,10 @@ class TagUpdater(SubThread):
                 call_hook("curses_update_complete", [])
 
     def prot_itemsdone(self, tag):
-        pass
+        self.items_done(self)
 
     def prot_tagchange(self, tag):
-        self.write("ITEMS", [ tag ])
+        self.write_items(tag)
 
     # The following is the external interface to tagupdater.
 
@@ -219,7 +572,7 @@ class TagUpdater(SubThread):
         self.reset()
         strtags = config.get_var("strtags")
         for tag in strtags:
-            self.write("ITEMS", [ tag ])
+            self.write_items(tag)
 
     def reset(self):
         self.updating += alltagcores
@@ -233,13 +586,83 @@ class TagUpdater(SubThread):
     # self.attributes and self.needed_attrs with our lock.
 
     def get_attributes(self, id):
-        r = {}
         self.lock.acquire_read()
-        if id in self.attributes:
-            r = self.attributes[id]
+        r = self.attributes.get(id)
         self.lock.release_read()
+
+        if r is None:
+            return self.attributes.empty(id)
         return r
 
+    # get_attributes for a lot of IDs (i.e. new stories) at once.
+
+    def get_all_attributes(self, ids):
+        self.lock.acquire_read()
+        get = self.attributes.get
+        r = [ get(id) for id in ids ]
+        self.lock.release_read()
+
+        empty = self.attributes.empty
+        return [ record if record is not None else empty(id)\
+                for (id, record) in zip(ids, r) ]
+
+    # Record a change we've made ourselves (i.e. item-state), returning the
+    # new record. This doesn't tell the daemon, see set_attributes, but it
+    # does let any other stories with the same ID know.
+
+    def change_attributes(self, id, d):
+        self.lock.acquire_write()
+        r = self.attributes.update_local(id, d)
+        self.lock.release_write()
+
+        self.dispatch_attributes({ id : r })
+        return r
+
+    # Tags subscribe to the IDs of their stories, instead of every story
+    # hooking curses_attributes and checking every update for itself.
+
+    def subscribe(self, ids, callback):
+        self.lock.acquire_write()
+        subscribers = self.subscribers
+        for id in ids:
+            if id in subscribers:
+                subscribers[id].append(callback)
+            else:
+                subscribers[id] = [ callback ]
+        self.lock.release_write()
+
+    def unsubscribe(self, ids, callback):
+        self.lock.acquire_write()
+        subscribers = self.subscribers
+        for id in ids:
+            callbacks = subscribers.get(id)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del subscribers[id]
+        self.lock.release_write()
+
+    # Hand each updated record to whoever's subscribed to its ID, then call
+    # curses_attributes for anyone else (i.e. the reader) interested.
+    #
+    # Callbacks are collected under lock, but called without it, as they may
+    # need config_lock (i.e. to set needs_redraw).
+
+    def dispatch_attributes(self, updated):
+        calls = []
+
+        self.lock.acquire_read()
+        for id, record in updated.items():
+            if id in self.subscribers:
+                for callback in self.subscribers[id]:
+                    calls.append((callback, record))
+        self.lock.release_read()
+
+        for callback, record in calls:
+            callback(record)
+
+        call_hook("curses_attributes", [ updated ])
+
     # This takes a fat argument because callers need to be able to curry
     # together multiple sets so stuff like 'item-state read *' don't generate
     # thousands of SETATTRIBUTES calls and take forever
@@ -249,10 +672,36 @@ class TagUpdater(SubThread):
         self.write("SETATTRIBUTES", arg)
         self.lock.release_write()
 
+    # Must be called holding lock (write). An empty attrs list asks for all
+    # attributes, like the ATTRIBUTES command.
+
+    def _queue_attributes(self, id, attrs):
+        inflight = self.inflight_attrs.get(id, [])
+        pending = self.pending_attrs.get(id, [])
+
+        if inflight is None or pending is None:
+            return
+
+        if attrs == []:
+            self.pending_attrs[id] = None
+            return
+
+        for attr in attrs:
+            if attr not in inflight and attr not in pending:
+                pending.append(attr)
+
+        if pending:
+            self.pending_attrs[id] = pending
+
+    # Requests are sent on the next flush_attributes, which the GUI does after
+    # every pass, so anything asked for during a render goes out together.
+
     def request_attributes(self, id, attrs):
-        self.write("ATTRIBUTES", { id : attrs })
+        self.lock.acquire_write()
+        self._queue_attributes(id, attrs)
+        self.lock.release_write()
 
-    def need_attributes(self, id, attrs):
+    def need_attributes(self, ids, attrs):
         self.lock.acquire_write()
 
         needed = self.needed_attrs[:]
@@ -265,13 +714,108 @@ class TagUpdater(SubThread):
 
         if updated:
             self.needed_attrs = needed
-            self.write("AUTOATTR", self.needed_attrs)
+            self.autoattr_pending = True
+
+        # Even if we didn't update this time, make sure we attempt to get these
+        # ids' new needed attributes.
+
+        for id in ids:
+            self._queue_attributes(id, needed)
+
+        self.lock.release_write()
+
+    # Mark these ids (i.e. on screen) as recently used, so they're the last
+    # to be evicted.
+
+    def touch_attributes(self, ids):
+        self.lock.acquire_write()
+        self.attributes.touch(ids)
+        self.lock.release_write()
+
+    # Ask for the needed attributes of any of these ids that don't have them,
+    # or only have them from the cache (i.e. stories on screen in lazy mode).
+
+    def want_attributes(self, ids):
+        self.lock.acquire_write()
+
+        needed = self.needed_attrs
+        for id in ids:
+            record = self.attributes.get(id)
+            if record is not None and id not in self.stale:
+                for attr in needed:
+                    if attr not in record:
+                        break
+                else:
+                    continue
+            self._queue_attributes(id, needed)
 
         self.lock.release_write()
 
-        # Even if we didn't update this time, make sure we attempt to get this
-        # id's new needed attributes.
+    # Called periodically, when the GUI isn't busy, to ask for the next
+    # update.lazy.fill attributes we haven't fetched in lazy mode. They're
+    # still sent ATTRIBUTES_BATCH at a time, see flush_attributes.
+
+    def fill_attributes(self):
+        fill = update_lazy_fill()
+        if not self.unfetched or not fill:
+            return
+
+        self.lock.acquire_write()
+
+        ids = []
+        for id in self.unfetched:
+            ids.append(id)
+            if len(ids) >= fill:
+                break
+
+        for id in ids:
+            del self.unfetched[id]
+            if id not in self.attributes or id in self.stale:
+                self._queue_attributes(id, self.needed_attrs)
+
+        self.lock.release_write()
+
+        self.flush_attributes()
+
+    # Send any queued requests, at most ATTRIBUTES_BATCH IDs per message, and
+    # remember them as in flight until their attributes arrive so we don't ask
+    # twice.
+
+    def flush_attributes(self):
+        if not self.pending_attrs and not self.autoattr_pending:
+            return
+
+        self.lock.acquire_write()
+
+        pending = self.pending_attrs
+        self.pending_attrs = {}
+
+        autoattr = self.autoattr_pending
+        self.autoattr_pending = False
+
+        for id, attrs in pending.items():
+            inflight = self.inflight_attrs.get(id, [])
+            if attrs is None:
+                self.inflight_attrs[id] = None
+            elif inflight is not None:
+                self.inflight_attrs[id] = inflight + attrs
+
+        self.lock.release_write()
+
+        if autoattr:
+            self.write_all("AUTOATTR", self.autoattr())
+
+        batch = {}
+        for id, attrs in pending.items():
+            if attrs is None:
+                attrs = []
+            batch[id] = attrs
+
+            if len(batch) >= ATTRIBUTES_BATCH:
+                self.write("ATTRIBUTES", batch)
+                batch = {}
 
-        self.write("ATTRIBUTES", { id : needed })
+        if batch:
+            self.write("ATTRIBUTES", batch)
 
 tag_updater = TagUpdater()
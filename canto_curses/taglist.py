@@ -6,15 +6,17 @@
 #   it under the terms of the GNU General Public License version 2 as 
 #   published by the Free Software Foundation.
 
-from canto_next.hooks import on_hook, remove_hook, unhook_all
+from canto_next.hooks import on_hook, unhook_all
 from canto_next.plugins import Plugin
 
 from .command import register_commands, register_arg_types, unregister_all, _int_range, _int_check, _string
 from .tagcore import tag_updater, alltagcores
 from .locks import config_lock
+from .config import config
 from .guibase import GuiBase
 from .reader import Reader
 from .tag import Tag, alltags
+from .theme import WrapPad, theme_print, theme_reset
 
 import logging
 import curses
@@ -32,6 +34,10 @@ log = logging.getLogger("TAGLIST")
 class TagListPlugin(Plugin):
     pass
 
+taglist_hide_empty_tags = config.accessor("taglist.hide_empty_tags")
+taglist_search_attributes = config.accessor("taglist.search_attributes")
+update_lazy_prefetch = config.accessor("update.lazy.prefetch")
+
 class TagList(GuiBase):
     def init(self, pad, callbacks):
         GuiBase.init(self)
@@ -64,6 +70,7 @@ class TagList(GuiBase):
         on_hook("curses_stories_added", self.on_stories_added, self)
         on_hook("curses_stories_removed", self.on_stories_removed, self)
         on_hook("curses_opt_change", self.on_opt_change, self)
+        on_hook("curses_tag_opt_change", self.on_tag_opt_change, self)
         on_hook("curses_new_tagcore", self.on_new_tagcore, self)
         on_hook("curses_del_tagcore", self.on_del_tagcore, self)
 
@@ -153,6 +160,7 @@ class TagList(GuiBase):
     def die(self):
         log.debug("Cleaning up hooks...")
         unhook_all(self)
+        config.unwatch_all(self)
         unregister_all(self)
 
     def tag_by_item(self, item):
@@ -176,13 +184,13 @@ class TagList(GuiBase):
         if "input_prompt" in vars:
             self.callbacks["set_opt"]("story.enumerated", False)
             self.callbacks["release_gui"]()
-            remove_hook("curses_var_change", self.unhook_item_list)
+            config.unwatch("input_prompt", self.unhook_item_list)
 
     def hook_item_list(self):
         if not self.callbacks["get_opt"]("story.enumerated"):
             self.callbacks["set_opt"]("story.enumerated", True)
             self.callbacks["release_gui"]()
-            on_hook("curses_var_change", self.unhook_item_list, self)
+            config.watch("input_prompt", self.unhook_item_list, self)
 
     def type_item_list(self):
         all_items = []
@@ -232,13 +240,13 @@ class TagList(GuiBase):
         if "input_prompt" in vars:
             self.callbacks["set_opt"]("taglist.tags_enumerated", False)
             self.callbacks["release_gui"]()
-            remove_hook("curses_var_change", self.unhook_tag_list)
+            config.unwatch("input_prompt", self.unhook_tag_list)
 
     def hook_tag_list(self):
         if not self.callbacks["get_opt"]("taglist.tags_enumerated"):
             self.callbacks["set_opt"]("taglist.tags_enumerated", True)
             self.callbacks["release_gui"]()
-            on_hook("curses_var_change", self.unhook_tag_list, self)
+            config.watch("input_prompt", self.unhook_tag_list, self)
 
     def type_tag_list(self):
         vtags = self.callbacks["get_var"]("taglist_visible_tags")
@@ -313,35 +321,89 @@ class TagList(GuiBase):
         # Items being removed implies we need to remap them.
         self.callbacks["set_var"]("needs_refresh", True)
 
+    # Tags and stories compare their option dependencies (config.deps) on
+    # render, so all we have to do here is make sure a redraw happens.
+
     def on_opt_change(self, conf):
+        self.callbacks["set_var"]("needs_redraw", True)
+
+        if "story" in conf and "format_attrs" in conf["story"]:
+            fa = self.callbacks["get_opt"]("story.format_attrs")
+            ids = []
+            for tag in alltags:
+                for story in tag:
+                    for a in fa:
+                        if a not in story.content:
+                            ids.append(story.id)
+                            break
+            if ids:
+                log.debug("%d stories need: %s", len(ids), fa)
+                tag_updater.need_attributes(ids, fa)
+                tag_updater.flush_attributes()
+
         if "taglist" not in conf:
             return
 
         if "search_attributes" in conf["taglist"]:
             log.info("Fetching any needed search attributes")
 
-            need_attrs = {}
             sa = self.callbacks["get_opt"]("taglist.search_attributes")
 
             # Make sure that we have all attributes needed for a search.
+            ids = []
             for tag in alltagcores:
-                for item in tag:
-                    tag_updater.need_attributes(item, sa)
+                ids.extend(tag)
+
+            tag_updater.need_attributes(ids, sa)
+            tag_updater.flush_attributes()
 
         if "spacing" in conf["taglist"]:
             self.spacing = conf["taglist"]["spacing"]
             self.callbacks["set_var"]("needs_refresh", True)
 
+    # Collapsing or expanding a tag changes which items are visible, so that
+    # needs a remap, anything else is just a redraw.
+
+    def on_tag_opt_change(self, conf):
+        for tag in conf.values():
+            if "collapsed" in tag:
+                self.callbacks["set_var"]("needs_refresh", True)
+                return
+        self.callbacks["set_var"]("needs_redraw", True)
+
+    # In lazy mode, or once they've been evicted, stories may not have their
+    # attributes. Ask for them and leave those stories out, rather than act on
+    # state we don't have (and overwrite the daemon's with it).
+
+    def _fetched(self, items, attr):
+        missing = [ item.id for item in items if attr not in item.content ]
+        if not missing:
+            return items
+
+        tag_updater.want_attributes(missing)
+        log.info("Skipping %d item(s) not fetched yet, try again shortly." %\
+                len(missing))
+
+        return [ item for item in items if attr in item.content ]
+
     def cmd_goto(self, items):
         log.debug("GOTO: %s", items)
-        self._goto([item.content["link"] for item in items])
+        items = self._fetched(items, "link")
+        if items:
+            self._goto([item.content["link"] for item in items])
 
     def cmd_tag_state(self, state, tags):
-        attributes = {}
+        items = []
         for tag in tags:
-            for item in tag:
-                if item.handle_state(state):
-                    attributes[item.id] = { "canto-state" : item.content["canto-state"] }
+            items.extend(tag)
+
+        if state.lstrip("-%") != "marked":
+            items = self._fetched(items, "canto-state")
+
+        attributes = {}
+        for item in items:
+            if item.handle_state(state):
+                attributes[item.id] = { "canto-state" : item.content["canto-state"] }
 
         if attributes:
             tag_updater.set_attributes(attributes)
@@ -349,6 +411,9 @@ class TagList(GuiBase):
     # item-state: Add/remove state for multiple items.
 
     def cmd_item_state(self, state, items):
+        if state.lstrip("-%") != "marked":
+            items = self._fetched(items, "canto-state")
+
         attributes = {}
         for item in items:
             if item.handle_state(state):
@@ -366,6 +431,8 @@ class TagList(GuiBase):
         else:
             tag = "user:" + tag
 
+        items = self._fetched(items, "canto-tags")
+
         attributes = {}
         for item in items:
             if item.handle_tag(tag):
@@ -461,8 +528,7 @@ class TagList(GuiBase):
 
         if item:
 
-            conf = self.callbacks["get_conf"]()
-            curstyle = conf["taglist"]["cursor"]
+            curstyle = self.callbacks["get_opt"]("taglist.cursor")
 
             # Convert window position for absolute positioning, edge
             # positioning uses given window_location.
@@ -702,7 +768,7 @@ class TagList(GuiBase):
 
     def cmd_toggle_collapse(self, tags):
         for tag in tags:
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
+            if tag.opt_collapsed():
                 self._uncollapse_tag(tag)
             else:
                 self._collapse_tag(tag)
@@ -715,7 +781,7 @@ class TagList(GuiBase):
             return
 
         story = self.first_story
-        terms = self.callbacks["get_opt"]("taglist.search_attributes")
+        terms = taglist_search_attributes()
 
         while story:
             for t in terms:
@@ -866,8 +932,8 @@ class TagList(GuiBase):
 
     def cmd_categories(self, tags):
         for tag in tags:
-            tc = self.callbacks["get_tag_conf"](tag.tag)
-            categories = [ x[9:] for x in tc["extra_tags"] if x.startswith("category:")]
+            extra_tags = self.callbacks["get_tag_opt"](tag.tag, "extra_tags")
+            categories = [ x[9:] for x in extra_tags if x.startswith("category:")]
             if categories == []:
                 log.info("%s - No categories" % tag)
             else:
@@ -925,7 +991,7 @@ class TagList(GuiBase):
             self.callbacks["set_var"]("target_obj", None)
             self.callbacks["set_var"]("target_offset", 0)
 
-        hide_empty = self.callbacks["get_opt"]("taglist.hide_empty_tags")
+        hide_empty = taglist_hide_empty_tags()
 
         cur_item_offset = 0
         cur_sel_offset = 0
@@ -941,7 +1007,7 @@ class TagList(GuiBase):
             tag.set_tag_offset(i)
             tag.set_visible_tag_offset(len(t))
 
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
+            if tag.opt_collapsed():
                 cur_sel_offset += 1
             else:
                 cur_sel_offset += len(tag)
@@ -1003,7 +1069,7 @@ class TagList(GuiBase):
             prev_obj = tag
 
             # Collapsed tags (with items) skip stories.
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
+            if tag.opt_collapsed():
                 if prev_sel:
                     prev_sel.next_sel = tag
                 prev_sel = tag
@@ -1076,10 +1142,28 @@ class TagList(GuiBase):
             if draw_lines:
                 pad.overwrite(self.pad, start, 0, main_offset, 0,
                         main_offset + (draw_lines - 1), self.width - 1)
+
+                # Stories' enumeration hints go on top here, rather than
+                # into their pads, so that offsets changing doesn't mean
+                # rendering them again.
+
+                if not obj.is_tag and start == 0:
+                    self._render_enum_hint(obj, main_offset)
+
                 return (main_offset + draw_lines, curpos + lines)
 
         return (main_offset, curpos + lines)
 
+    def _render_enum_hint(self, story, main_offset):
+        header = story.enum_hint()
+        if not header:
+            return
+
+        pad = WrapPad(self.pad)
+        pad.move(main_offset, 0)
+        theme_print(pad, header, self.width, "", "", False, False)
+        theme_reset()
+
     def redraw(self):
         log.debug("Taglist REDRAW (%s)!\n", self.width)
         self.pad.erase()
@@ -1175,7 +1259,7 @@ class TagList(GuiBase):
         self.first_sel = obj
         while self.first_sel.is_tag:
 
-            if self.callbacks["get_tag_opt"](obj.tag, "collapsed"):
+            if obj.opt_collapsed():
                 break
 
             # We use obj instead of sel here because next_sel will only be set
@@ -1189,6 +1273,7 @@ class TagList(GuiBase):
 
         # Step 4. Render.
 
+        first_obj = obj
         rendered_header = False
         w_offset = 0
 
@@ -1240,8 +1325,61 @@ class TagList(GuiBase):
 
             obj = obj.next_obj
 
+        # Step 5. Keep the attributes of stories on and near the screen from
+        # being evicted and, in lazy mode, ask for those just off screen so
+        # they're ready when we scroll. Stories on screen already asked when
+        # they found their attributes missing in lines(). Tags on screen get
+        # their updates over the priority connection.
+
+        self._track_viewport(first_obj, obj)
+
         self.callbacks["refresh"]()
 
+    def _track_viewport(self, first_obj, last_obj):
+        horizon = update_lazy_prefetch()
+        ids = []
+        tags = []
+
+        # Let each tag's sync start from its first story on screen.
+
+        for tag in alltags:
+            tag.view_story = None
+
+        # Identity, not truth or equality, as empty tags are falsy and equal
+        # to each other (see Tag.__eq__).
+
+        obj = first_obj
+        while obj is not None and obj is not last_obj:
+            tag = self.tag_by_obj(obj)
+            if not obj.is_tag:
+                ids.append(obj.id)
+                if tag.view_story is None:
+                    tag.view_story = obj
+            if tag.tag not in tags:
+                tags.append(tag.tag)
+            obj = obj.next_obj
+
+        sel = self.callbacks["get_var"]("selected")
+        if sel is not None:
+            tag = self.tag_by_obj(sel)
+            if tag.tag not in tags:
+                tags.append(tag.tag)
+
+        tag_updater.set_priority_tags(tags)
+
+        for obj, attr in [ (first_obj, "prev_obj"), (last_obj, "next_obj") ]:
+            count = 0
+            while obj is not None and count < horizon:
+                if not obj.is_tag:
+                    ids.append(obj.id)
+                    count += 1
+                obj = getattr(obj, attr)
+
+        tag_updater.touch_attributes(ids)
+
+        if tag_updater.lazy:
+            tag_updater.want_attributes(ids)
+
     def is_input(self):
         return False
 
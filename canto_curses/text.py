@@ -6,11 +6,12 @@
 #   it under the terms of the GNU General Public License version 2 as 
 #   published by the Free Software Foundation.
 
-from canto_next.hooks import on_hook, unhook_all
+from canto_next.hooks import unhook_all
 
 from .theme import FakePad, WrapPad, theme_print, theme_lstrip, theme_border, theme_reset
 from .command import register_commands, unregister_command
 from .guibase import GuiBase
+from .config import config
 from .color import cc
 
 import logging
@@ -213,17 +214,17 @@ class VarBox(TextBox):
         self.var = var
         self.value = self.callbacks["get_var"](var)
 
-        on_hook("curses_var_change", self.on_var_change, self)
+        config.watch(var, self.on_var_change, self)
 
     def on_var_change(self, change):
-        if self.var in change:
-            self.value = change[self.var]
-            if self.value == "":
-                self.cmd_destroy()
-            self.callbacks["set_var"]("needs_refresh", True)
+        self.value = change[self.var]
+        if self.value == "":
+            self.cmd_destroy()
+        self.callbacks["set_var"]("needs_refresh", True)
 
     def cmd_destroy(self):
         unhook_all(self)
+        config.unwatch_all(self)
         TextBox.cmd_destroy(self)
 
 class InfoBox(VarBox):
@@ -30,6 +30,8 @@ from canto_next.plugins import check_program
 check_program("canto-curses")
 
 from canto_curses.gui import GuiPlugin
+from canto_curses.config import config
+from canto_curses.locks import sync_lock
 from canto_next.hooks import on_hook
 
 class AutoCmdGui(GuiPlugin):
@@ -39,8 +41,17 @@ class AutoCmdGui(GuiPlugin):
 
         on_hook("curses_start", self.do_cmds)
 
+    # Run all of the commands as one config transaction so that their changes
+    # reach the daemon in a single round-trip. sync_lock is taken first, like
+    # issue_cmd would, to keep the lock order.
+
     def do_cmds(self):
         self.gui.callbacks["set_var"]("quiet", True)
-        for cmd in cmds:
-            self.gui.issue_cmd(cmd)
+        sync_lock.acquire_write()
+        try:
+            with config.transaction():
+                for cmd in cmds:
+                    self.gui.issue_cmd(cmd)
+        finally:
+            sync_lock.release_write()
         self.gui.callbacks["set_var"]("quiet", False)
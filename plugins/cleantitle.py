@@ -62,4 +62,4 @@ class CleanTitle(StoryPlugin):
         if NO_HTML_EVER:
             t = remove_html_markup(t)
 
-        self.story.content["title"] = t
+        self.story.content = self.story.content.replace({ "title" : t })
@@ -67,9 +67,8 @@ class CantoThemeTagDefault(TagPlugin):
         # Make sure to strip out the category from category:name
         str_tag = tag.tag.split(':', 1)[1]
 
-        unread = len([s for s in tag\
-                if "canto-state" not in s.content or\
-                "read" not in s.content["canto-state"]])
+        counts = tag.get_counts()
+        unread = counts["unread"]
 
         s = ""
 
@@ -85,8 +84,8 @@ class CantoThemeTagDefault(TagPlugin):
 
         s += "[" + cc("unread") + str(unread) + cc.end("unread") + "]"
 
-        if tag.updates_pending:
-            s += " [" + cc("pending") + str(tag.updates_pending) + cc.end("pending") + "]"
+        if counts["pending"]:
+            s += " [" + cc("pending") + str(counts["pending"]) + cc.end("pending") + "]"
 
         if tag.selected:
             s += cc.end("selected")
@@ -97,6 +96,8 @@ class CantoThemeTagDefault(TagPlugin):
 # dependency.
 
 from canto_curses.gui import GuiPlugin
+from canto_curses.config import config
+from canto_curses.locks import sync_lock
 from canto_next.hooks import on_hook
 
 class AutoCmdGui(GuiPlugin):
@@ -106,8 +107,17 @@ class AutoCmdGui(GuiPlugin):
 
         on_hook("curses_start", self.do_cmds)
 
+    # Run all of the commands as one config transaction so that their changes
+    # reach the daemon in a single round-trip. sync_lock is taken first, like
+    # issue_cmd would, to keep the lock order.
+
     def do_cmds(self):
         self.gui.callbacks["set_var"]("quiet", True)
-        for cmd in cmds:
-            self.gui.issue_cmd(cmd)
+        sync_lock.acquire_write()
+        try:
+            with config.transaction():
+                for cmd in cmds:
+                    self.gui.issue_cmd(cmd)
+        finally:
+            sync_lock.release_write()
         self.gui.callbacks["set_var"]("quiet", False)
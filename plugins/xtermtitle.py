@@ -5,11 +5,15 @@
 # Set to True if you want the selection title included.
 USE_TITLE=False
 
+# Set to True if you want the unread count of the selection's tag included.
+USE_UNREAD=False
+
 from canto_next.plugins import check_program
 
 check_program("canto-curses")
 
 from canto_next.hooks import on_hook
+from canto_curses.config import config
 import locale
 import os
 
@@ -22,14 +26,20 @@ def clear_xterm_title():
     os.write(1, "\033]0; \007".encode(prefcode))
 
 def xt_on_var_change(var_dict):
-    if "selected" in var_dict:
-        if var_dict["selected"] and "title" in var_dict["selected"].content:
-            set_xterm_title("Canto - " + var_dict["selected"].content["title"])
-        else:
-            set_xterm_title("Canto")
-
-if USE_TITLE:
-    on_hook("curses_var_change", xt_on_var_change)
+    sel = var_dict["selected"]
+    s = "Canto"
+
+    if sel and USE_UNREAD:
+        tag = sel if sel.is_tag else sel.parent_tag
+        s += " [%d]" % tag.get_counts()["unread"]
+
+    if sel and USE_TITLE and not sel.is_tag and "title" in sel.content:
+        s += " - " + sel.content["title"]
+
+    set_xterm_title(s)
+
+if USE_TITLE or USE_UNREAD:
+    config.watch("selected", xt_on_var_change)
 else:
     on_hook("curses_start", lambda: set_xterm_title("Canto"))
 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Measure the memory used to hold the automatic attributes (see
+# TagUpdater.needed_attrs) for a lot of stories, as a dict per story the way
+# TagUpdater used to keep them versus the AttributeStore.
+
+from canto_curses.attrstore import AttributeStore
+
+import tracemalloc
+import json
+
+SIZES = [ 100000, 1000000 ]
+
+STATES = [ [], [ "read" ], [ "read", "marked" ] ]
+TAGS = [ [], [ "user:favorite" ] ]
+
+def attributes(n):
+    for i in range(n):
+        feed = i % 200
+        id = json.dumps({ "URL" : "http://example.com/feed-%d.xml" % feed,\
+                "ID" : "http://example.com/feed-%d/story-%d" % (feed, i) })
+
+        # Round trip through JSON, like they come from the daemon, so that
+        # nothing is shared by accident.
+
+        yield id, json.loads(json.dumps({
+            "title" : "Story number %d from feed %d" % (i, feed),
+            "link" : "http://example.com/feed-%d/story-%d" % (feed, i),
+            "canto-state" : STATES[i % len(STATES)],
+            "canto-tags" : TAGS[i % len(TAGS)],
+            "enclosures" : "",
+            "author" : "Author %d" % (feed % 20),
+        }))
+
+def as_dicts(n):
+    r = {}
+    for id, d in attributes(n):
+        r[id] = d
+    return r
+
+def as_store(n):
+    r = AttributeStore()
+    for id, d in attributes(n):
+        r.update(id, d)
+    return r
+
+def measure(f, n):
+    tracemalloc.start()
+    r = f(n)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del r
+    return size
+
+print("%8s %16s %16s" % ("stories", "dicts (MB)", "store (MB)"))
+
+for n in SIZES:
+    d = measure(as_dicts, n)
+    s = measure(as_store, n)
+    print("%8d %16.1f %16.1f" % (n, d / (1024 * 1024), s / (1024 * 1024)))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Time saving and loading the ItemCache (update.cache.persist) for a large
+# set of stored items. Loading is what stands between startup and the first
+# screen when the cache is on, where without it we wait for the daemon to send
+# ITEMS and ATTRIBUTES for every tag.
+
+from canto_curses.cache import ItemCache
+
+import tempfile
+import time
+import os
+
+SIZES = [ 20000, 200000 ]
+TAGS = 100
+
+def contents(n):
+    tags = {}
+    attributes = {}
+    for i in range(n):
+        feed = i % TAGS
+        id = "{\"URL\": \"http://example.com/feed-%d.xml\", \"ID\": \"story-%d\"}" % (feed, i)
+        tags.setdefault("maintag:Feed %d" % feed, []).append(id)
+        attributes[id] = {
+            "title" : "Story number %d from feed %d" % (i, feed),
+            "link" : "http://example.com/feed-%d/story-%d" % (feed, i),
+            "canto-state" : [ "read" ] if i % 2 else [],
+            "canto-tags" : [],
+            "enclosures" : "",
+        }
+    return tags, attributes
+
+print("%8s %12s %12s" % ("items", "save (s)", "load (s)"))
+
+for n in SIZES:
+    tags, attributes = contents(n)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "curses-cache.db")
+
+        cache = ItemCache(path, "bench")
+        cache.open()
+        start = time.time()
+        cache.save(tags, attributes)
+        t_save = time.time() - start
+        cache.close()
+
+        cache = ItemCache(path, "bench")
+        start = time.time()
+        cache.open()
+        l_tags, l_attributes = cache.load()
+        t_load = time.time() - start
+        cache.close()
+
+        if len(l_attributes) != n or len(l_tags) != len(tags):
+            raise Exception("Cache lost items!")
+
+    print("%8d %12.3f %12.3f" % (n, t_save, t_load))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Time how long it takes to validate a single option toggle (i.e. set_opt,
+# show-links, enumeration) as the rest of the config grows. With validation
+# scoped to the changed subtree, the toggle should stay flat while a full
+# validation grows with the config.
+
+from canto_curses.config import config, assign_path, opt_path, thaw
+from canto_curses.locks import config_lock
+
+import timeit
+
+SIZES = [ 0, 100, 1000, 10000 ]
+ROUNDS = 200
+
+KEY_SECTIONS = [ "main", "screen", "taglist", "reader", "errorbox", "infobox" ]
+
+def grow_config(n):
+    c = thaw(config.template_config)
+
+    for section in KEY_SECTIONS:
+        for i in range(n):
+            c[section]["key"]["bench-%d" % i] = "noop %d" % i
+
+    for i in range(n):
+        c["style"]["bench-%d" % i] = "%%B%d%%b" % i
+
+    config_lock.acquire_write()
+    config.validate_config(c, config.template_config, config.validators)
+    config._publish(config = c)
+    config_lock.release_write()
+
+def toggle():
+    cur = config.get_opt("reader.enumerate_links")
+    c = assign_path(config.config, opt_path("reader.enumerate_links"), not cur)
+    config.validate_config(c, config.config, config.validators)
+
+def full():
+    c = thaw(config.config)
+    c["reader"]["enumerate_links"] = not c["reader"]["enumerate_links"]
+    config.validate_config(c, thaw(config.template_config), config.validators)
+
+print("%8s %16s %16s" % ("size", "toggle (us)", "full (us)"))
+
+for n in SIZES:
+    grow_config(n)
+
+    t_toggle = timeit.timeit(toggle, number=ROUNDS) / ROUNDS
+    t_full = timeit.timeit(full, number=ROUNDS // 10) / (ROUNDS // 10)
+
+    print("%8d %16.1f %16.1f" % (n, t_toggle * 1000000, t_full * 1000000))
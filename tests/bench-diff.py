@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Time diffing a tag's current IDs against a new ITEMS response, the way
+# TagUpdater.prot_items and Tag.sync do, for large (i.e. aggregate user tag)
+# sizes. The old sort + pop(0) merge is quadratic, so it's only timed up to
+# LEGACY_MAX items.
+
+from canto_curses.tagcore import diff_ids
+
+import time
+
+SIZES = [ 10000, 100000, 500000 ]
+LEGACY_MAX = 100000
+
+# Fraction of items that fall out of / come into the tag per update.
+CHURN = 0.01
+
+def make_ids(n):
+    old = [ "item-%d" % i for i in range(n) ]
+    drop = int(n * CHURN)
+    new = [ "item-%d" % i for i in range(n + drop) ][drop:]
+    return old, new
+
+def legacy_diff(old, new):
+    sorted_updated_ids = list(enumerate(new))
+    sorted_updated_ids.sort(key=lambda x : x[1])
+
+    sorted_current_ids = list(enumerate(old))
+    sorted_current_ids.sort(key=lambda x : x[1])
+
+    new_ids = []
+    cur_ids = []
+    old_ids = []
+
+    for c_place, c_id in sorted_current_ids:
+        while sorted_updated_ids and c_id > sorted_updated_ids[0][1]:
+            new_ids.append(sorted_updated_ids.pop(0))
+
+        if not sorted_updated_ids or c_id < sorted_updated_ids[0][1]:
+            old_ids.append(c_id)
+        else:
+            cur_ids.append(sorted_updated_ids.pop(0))
+
+    new_ids += sorted_updated_ids
+    return new_ids, cur_ids, old_ids
+
+def timed(f, *args):
+    start = time.time()
+    r = f(*args)
+    return r, time.time() - start
+
+print("%8s %16s %16s" % ("size", "legacy (ms)", "diff_ids (ms)"))
+
+for n in SIZES:
+    old, new = make_ids(n)
+
+    (added, kept, removed), t_diff = timed(diff_ids, old, new)
+
+    if len(added) != len(removed) or len(kept) + len(removed) != n:
+        raise Exception("Unexpected diff for %d items" % n)
+
+    if n <= LEGACY_MAX:
+        (l_new, l_cur, l_old), t_legacy = timed(legacy_diff, old, new)
+        if len(l_new) != len(added) or len(l_old) != len(removed):
+            raise Exception("Legacy diff disagrees for %d items" % n)
+        legacy = "%16.1f" % (t_legacy * 1000)
+    else:
+        legacy = "%16s" % "-"
+
+    print("%8d %s %16.1f" % (n, legacy, t_diff * 1000))
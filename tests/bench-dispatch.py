@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Count the callbacks made (and time them) for an ATTRIBUTES message updating a
+# handful of stories, when every Story and Tag hooks curses_attributes and
+# checks the update for itself, the way they used to, versus TagUpdater's
+# per-ID subscriptions.
+
+from canto_curses.tagcore import TagUpdater
+
+from canto_next.hooks import on_hook, remove_hook, call_hook
+from canto_next.rwlock import RWLock
+
+import time
+
+SIZES = [ 10000, 100000 ]
+TAGS = 100
+UPDATED = 10
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+        self.checks = 0
+
+class BroadcastStory(object):
+    def __init__(self, id, counter):
+        self.id = id
+        self.counter = counter
+        self.new_content = None
+
+    def on_attributes(self, attributes):
+        self.counter.calls += 1
+        self.counter.checks += 1
+        if self.id in attributes:
+            self.new_content = attributes[self.id]
+
+class BroadcastTag(list):
+    def __init__(self, counter):
+        list.__init__(self)
+        self.counter = counter
+
+    def on_attributes(self, attributes):
+        self.counter.calls += 1
+        for s in self:
+            self.counter.checks += 1
+            if s.id in attributes:
+                break
+
+class SubscribedStory(object):
+    def __init__(self, id, counter):
+        self.id = id
+        self.counter = counter
+        self.new_content = None
+
+    def on_attributes(self, record):
+        self.counter.calls += 1
+        self.new_content = record
+
+def broadcast(n, updated):
+    counter = Counter()
+    tags = [ BroadcastTag(counter) for i in range(TAGS) ]
+    for i in range(n):
+        s = BroadcastStory("id%d" % i, counter)
+        tags[i % TAGS].append(s)
+        on_hook("curses_attributes", s.on_attributes)
+    for tag in tags:
+        on_hook("curses_attributes", tag.on_attributes)
+
+    start = time.time()
+    call_hook("curses_attributes", [ updated ])
+    t = time.time() - start
+
+    for tag in tags:
+        remove_hook("curses_attributes", tag.on_attributes)
+        for s in tag:
+            remove_hook("curses_attributes", s.on_attributes)
+
+    return counter, t
+
+def subscribed(n, updated):
+    counter = Counter()
+
+    updater = TagUpdater()
+    updater.lock = RWLock("bench")
+    updater.subscribers = {}
+
+    for i in range(n):
+        s = SubscribedStory("id%d" % i, counter)
+        updater.subscribe([ s.id ], s.on_attributes)
+
+    start = time.time()
+    updater.dispatch_attributes(updated)
+    t = time.time() - start
+
+    return counter, t
+
+print("%8s %20s %20s %12s %12s" % ("stories", "broadcast calls/chk",\
+        "indexed calls/chk", "bcast (ms)", "index (ms)"))
+
+for n in SIZES:
+    updated = dict([ ("id%d" % (i * (n // UPDATED)), {}) for i in range(UPDATED) ])
+
+    b, t_b = broadcast(n, updated)
+    s, t_s = subscribed(n, updated)
+
+    if s.calls != UPDATED:
+        raise Exception("Expected %d subscribed calls, got %d" % (UPDATED, s.calls))
+
+    print("%8d %20s %20s %12.1f %12.1f" % (n, "%d/%d" % (b.calls, b.checks),\
+            "%d/%d" % (s.calls, s.calls), t_b * 1000, t_s * 1000))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Time a burst of BURST new items arriving in one ITEMS response for a tag,
+# through the parts that used to search lists: the TagCore diff and update,
+# Tag.on_items_added counting items it doesn't have yet, and on_stories_removed
+# checking whether removed stories are still in the TagCore.
+
+from canto_curses.tagcore import TagCore, diff_ids
+
+import time
+
+SIZES = [ 10000, 50000 ]
+BURST = 50000
+
+# Tag.on_items_added, with cur_ids either the old list or Tag.stories
+
+def count_pending(cur_ids, added):
+    pending = 0
+    for story_id in added:
+        if story_id not in cur_ids:
+            pending += 1
+    return pending
+
+def legacy_stories_removed(tagcore, ids):
+    return len([ id for id in ids if id in list(tagcore) ])
+
+def timed(f, *args):
+    start = time.time()
+    r = f(*args)
+    return r, time.time() - start
+
+print("%8s %8s %14s %14s %14s %14s" % ("tag", "burst", "items (ms)",\
+        "added (ms)", "removed (ms)", "legacy (ms)"))
+
+for n in SIZES:
+    old = [ "item-%d" % i for i in range(n) ]
+    new = old + [ "item-%d" % i for i in range(n, n + BURST) ]
+
+    tagcore = TagCore("maintag:bench-%d" % n)
+    tagcore.set_items(old)
+
+    # prot_items
+
+    def items():
+        added, kept, removed = diff_ids(tagcore, new, None, tagcore.positions)
+        tagcore.set_items(new)
+        return [ new[i] for i in added ]
+
+    new_ids, t_items = timed(items)
+
+    # Against a Tag still holding the old stories
+
+    stories = dict((id, None) for id in old)
+    pending, t_added = timed(count_pending, stories, new_ids)
+
+    # on_stories_removed, for a sample of IDs
+
+    sample = old[:100]
+    present, t_removed = timed(lambda : len([ id for id in sample if id in tagcore ]))
+
+    if pending != BURST or present != len(sample):
+        raise Exception("Unexpected results for %d items" % n)
+
+    # The old list based checks are quadratic, so they're only timed on a
+    # slice of the burst and scaled up.
+
+    part = new_ids[:1000]
+    l_pending, t_l_added = timed(count_pending, old, part)
+    l_present, t_l_removed = timed(legacy_stories_removed, tagcore, sample)
+    t_legacy = t_l_added * (BURST / len(part)) + t_l_removed
+
+    print("%8d %8d %14.1f %14.1f %14.1f %14.1f" % (n, BURST, t_items * 1000,\
+            t_added * 1000, t_removed * 1000, t_legacy * 1000))
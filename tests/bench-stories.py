@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Measure the memory used and the time taken to construct a lot of Story
+# objects, as Tag.sync makes them (plugins deferred until first render), with
+# plugins loaded up front, and, given a revision of canto-curses to compare
+# against, with the Story class from that revision, e.g.
+#
+#   bench-stories.py v0.9.9
+#
+# The Story class is read from the revision with git, and made as it was,
+# hooks and all.
+
+from canto_curses.tagcore import tag_updater
+from canto_curses.story import Story
+
+import importlib.util
+import subprocess
+import tracemalloc
+import time
+import sys
+import os
+
+SIZES = [ 10000, 100000 ]
+
+def baseline_story(rev):
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    source = subprocess.check_output([ "git", "show",\
+            rev + ":canto_curses/story.py" ], cwd=top)
+
+    spec = importlib.util.spec_from_loader("canto_curses.story_" + rev,\
+            loader=None)
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = "canto_curses"
+    exec(compile(source, "story.py@" + rev, "exec"), module.__dict__)
+    return module.Story
+
+def stories(cls, n, eager):
+    r = []
+    callbacks = {}
+    for i in range(n):
+        id = "id%d" % i
+        s = cls(None, id, callbacks)
+        if cls is Story:
+            s.content = tag_updater.get_attributes(id)
+            if eager:
+                s.load_plugins()
+        r.append(s)
+    return r
+
+def measure(cls, n, eager):
+    tracemalloc.start()
+    start = time.time()
+    r = stories(cls, n, eager)
+    t = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del r
+    return size, t
+
+classes = [ ("lazy", Story, False), ("eager", Story, True) ]
+if len(sys.argv) > 1:
+    classes.append((sys.argv[1], baseline_story(sys.argv[1]), False))
+
+print("%8s" % "stories" + "".join([ "%14s %14s" % (name + " (MB)",\
+        name + " (ms)") for (name, cls, eager) in classes ]))
+
+for n in SIZES:
+    line = "%8d" % n
+    for name, cls, eager in classes:
+        size, t = measure(cls, n, eager)
+        line += "%14.1f %14.1f" % (size / (1024 * 1024), t * 1000)
+    print(line)
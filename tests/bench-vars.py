@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Count how many var change callbacks are dispatched for a typical cursor
+# movement keypress, with the standard listeners (info / error boxes, reader,
+# xtermtitle, an item-list prompt) all on the curses_var_change broadcast
+# versus watching only the vars they care about.
+
+from canto_curses.config import config
+from canto_next.hooks import on_hook, unhook_all
+
+# Roughly what a single rel-set-cursor does, plus the redraw it causes.
+
+KEYPRESS = [
+    ("target_obj", 1), ("target_offset", 1), ("selected", 1),
+    ("needs_redraw", True), ("needs_refresh", True),
+    ("needs_redraw", False), ("needs_refresh", False),
+]
+
+LISTENERS = [ "info_msg", "error_msg", "selected", "selected", "input_prompt" ]
+
+KEYPRESSES = 100
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, change):
+        self.calls += 1
+
+def press(n):
+    for i in range(n):
+        for var, value in KEYPRESS:
+            # Make sure every set is an actual change
+            config.vars[var] = None
+            config.set_var(var, value)
+
+def count(register):
+    counters = []
+    for var in LISTENERS:
+        c = Counter()
+        register(var, c)
+        counters.append(c)
+
+    press(KEYPRESSES)
+
+    unhook_all("bench")
+    config.unwatch_all("bench")
+
+    return sum([ c.calls for c in counters ])
+
+broadcast = count(lambda var, c: on_hook("curses_var_change", c, "bench"))
+watched = count(lambda var, c: config.watch(var, c, "bench"))
+
+print("%d keypresses, %d listeners" % (KEYPRESSES, len(LISTENERS)))
+print("curses_var_change broadcast: %.1f dispatches / keypress" % (broadcast / KEYPRESSES))
+print("config.watch:                %.1f dispatches / keypress" % (watched / KEYPRESSES))
@@ -4,7 +4,7 @@
 from base import *
 
 from canto_curses.main import CANTO_PROTOCOL_COMPATIBLE
-from canto_curses.config import config
+from canto_curses.config import config, finalize_eval_settings, needs_eval
 
 from canto_next.hooks import on_hook
 
@@ -57,7 +57,7 @@ class TestConfigFunction(Test):
         script = {
             'VERSION' : { '*' : [('VERSION', CANTO_PROTOCOL_COMPATIBLE)] },
             'CONFIGS' : { '*' : [('CONFIGS', { "CantoCurses" : config.template_config })] },
-                
+            'PING' : { '*' : [("PONG", [])]}
         }
 
         backend = TestBackend("config", script)
@@ -175,6 +175,237 @@ class TestConfigFunction(Test):
         config.set_conf(c)
 
         self.compare_flags(OPT_CHANGE | EVAL_TAGS)
+
+        # 8. Opt getters share the current snapshot instead of copying it, and
+        # it can only be changed by publishing a new one with set_opt/set_conf
+
+        snap = config.snapshot()
+
+        if config.get_opt("taglist") is not config.get_opt("taglist"):
+            raise Exception("Expected get_opt to share the config snapshot")
+
+        try:
+            config.get_opt("taglist")["border"] = True
+        except TypeError:
+            pass
+        else:
+            raise Exception("Expected config snapshot to be read-only")
+
+        self.reset_flags()
+
+        config.set_opt("taglist.border", True)
+
+        self.compare_flags(OPT_CHANGE)
+        self.compare_var("oc_opts", { "taglist" : { "border" : True }})
+        self.compare_config(config.config, "taglist.border", True)
+        self.compare_config(snap.config, "taglist.border", False)
+
+        if config.snapshot().generation <= snap.generation:
+            raise Exception("Expected set_opt to publish a new generation")
+
+        # 9. Accessors are shared and follow newly published generations
+
+        border = config.accessor("taglist.border")
+
+        if border is not config.accessor("taglist.border"):
+            raise Exception("Expected accessors to be shared")
+
+        if border() != True:
+            raise Exception("Expected accessor to read current value")
+
+        config.set_opt("taglist.border", False)
+
+        if border() != False:
+            raise Exception("Expected accessor to follow set_opt")
+
+        # 10. Resolved tag options are cached per tag, and only rebuilt for the
+        # tag that changed.
+
+        if config.get_tag_opt("maintag:Slashdot", "collapsed") != False:
+            raise Exception("Expected template value for collapsed")
+
+        config.get_tag_opt("maintag:Test2", "collapsed")
+        test2 = config.resolved_tags["maintag:Test2"][2]
+
+        self.reset_flags()
+
+        config.set_tag_opt("maintag:Slashdot", "collapsed", True)
+
+        self.compare_flags(TAG_OPT_CHANGE)
+
+        if config.get_tag_opt("maintag:Slashdot", "collapsed") != True:
+            raise Exception("Expected set_tag_opt to be reflected")
+
+        config.get_tag_opt("maintag:Test2", "collapsed")
+
+        if config.resolved_tags["maintag:Test2"][2] is not test2:
+            raise Exception("Expected unchanged tag to keep its resolved options")
+
+        # 11. set_opt only touches the changed path, the rest of the config is
+        # shared with the previous snapshot.
+
+        snap = config.snapshot()
+
+        self.reset_flags()
+
+        config.set_opt("reader.enumerate_links", True)
+
+        self.compare_flags(OPT_CHANGE)
+        self.compare_var("oc_opts", { "reader" : { "enumerate_links" : True }})
+
+        if config.config["color"] is not snap.config["color"]:
+            raise Exception("Expected unchanged section to be shared")
+
+        if config.config["reader"]["key"] is not snap.config["reader"]["key"]:
+            raise Exception("Expected unchanged sibling to be shared")
+
+        # 12. Transactions collect changes, then validate, call hooks and
+        # write to the daemon once.
+
+        self.reset_flags()
+
+        sent = len(backend.output)
+
+        with config.transaction():
+            config.set_opt("taglist.wrap", False)
+            config.set_opt("taglist.spacing", 2)
+            config.set_tag_opt("maintag:Test2", "enumerated", True)
+
+            self.compare_flags(0)
+
+            if config.get_opt("taglist.wrap") != False:
+                raise Exception("Expected pending value inside transaction")
+
+            if config.get_tag_opt("maintag:Test2", "enumerated") != True:
+                raise Exception("Expected pending tag value inside transaction")
+
+            self.compare_config(config.config, "taglist.wrap", True)
+
+        self.compare_flags(OPT_CHANGE | TAG_OPT_CHANGE)
+        self.compare_var("oc_opts", { "taglist" : { "wrap" : False, "spacing" : 2 }})
+        self.compare_var("toc_opts", { "maintag:Test2" : { "enumerated" : True }})
+        self.compare_config(config.config, "taglist.spacing", 2)
+
+        output = backend.output[sent:]
+        if output != [ ("SETCONFIGS", { "tags" : { "maintag:Test2" : { "enumerated" : True }},
+                "CantoCurses" : { "taglist" : { "wrap" : False, "spacing" : 2 }}}),
+                ("PING", []) ]:
+            raise Exception("Unexpected transaction output: %s" % output)
+
+        # 13. Writes are acknowledged through futures, resolved by PONG
+
+        f = config.set_opt("taglist.spacing", 1)
+
+        self.compare_config(config.config, "taglist.spacing", 1)
+
+        done, not_done = config.flush(5)
+        if not_done or not f.done() or f.result() != True:
+            raise Exception("Expected write to be acknowledged")
+
+        config.write_behind = False
+        f = config.set_opt("taglist.spacing", 0)
+        config.write_behind = True
+
+        if not f.done():
+            raise Exception("Expected blocking write to wait for PONG")
+
+        # 14. Batched NEWTAGS / DELTAGS keep the tag position index in step
+        # with tagorder.
+
+        self.reset_flags()
+
+        backend.inject("NEWTAGS", [ "alt:t4", "alt:t5", "alt:t6" ])
+
+        self.compare_flags(NEW_TAG | OPT_CHANGE | EVAL_TAGS)
+        self.compare_config(config.vars, "curtags", [ "alt:t1", "alt:t2", "alt:t3", "alt:t4", "alt:t5", "alt:t6" ])
+
+        config.switch_tags("alt:t4", "alt:t6")
+
+        self.compare_config(config.vars, "curtags", [ "alt:t1", "alt:t2", "alt:t3", "alt:t6", "alt:t5", "alt:t4" ])
+
+        # Tags switched in a transaction are evaluated once it's committed.
+
+        with config.transaction():
+            config.switch_tags("alt:t6", "alt:t4")
+
+        self.compare_config(config.vars, "curtags", [ "alt:t1", "alt:t2", "alt:t3", "alt:t4", "alt:t5", "alt:t6" ])
+
+        config.switch_tags("alt:t4", "alt:t6")
+
+        self.reset_flags()
+
+        backend.inject("DELTAGS", [ "alt:t1", "alt:t5" ])
+
+        self.compare_flags(DEL_TAG | OPT_CHANGE | EVAL_TAGS)
+        self.compare_config(config.config, "tagorder", [ "test1", "maintag:Slashdot", "maintag:Test3","maintag:Test2", "alt:t2", "alt:t3", "alt:t6", "alt:t4" ])
+        self.compare_config(config.vars, "curtags", [ "alt:t2", "alt:t3", "alt:t6", "alt:t4" ])
+
+        positions = config.tag_positions()
+        for i, tag in enumerate(config.config["tagorder"]):
+            if positions[tag] != i:
+                raise Exception("Tag position index out of date for %s" % tag)
+
+        # 15. Option schema
+
+        finalize_eval_settings()
+
+        if config.schema.validator("taglist.border") != config.validate_bool:
+            raise Exception("Expected schema to find taglist.border validator")
+
+        if config.schema.validator("tag.collapsed") != config.validate_bool:
+            raise Exception("Expected schema to find tag.collapsed validator")
+
+        for opt, evalue in [ ("taglist.border", True), ("browser.path", False),\
+                ("color.unread", True), ("reader.window.maxwidth", True),\
+                ("main.key.q", False), ("feed.rate", True) ]:
+            if needs_eval(opt) != evalue:
+                raise Exception("Expected needs_eval(%s) == %s" % (opt, evalue))
+
+        paths = config.option_paths()
+        for opt in [ "taglist.border", "main.key.q", "tag.collapsed", "feed.rate" ]:
+            if opt not in paths:
+                raise Exception("Expected %s in option completions" % opt)
+
+        if config.option_paths() is not paths:
+            raise Exception("Expected option completions to be cached")
+
+        # 16. Var watchers are only called for their var, and a broken one
+        # doesn't stop the others.
+
+        changes = []
+
+        config.watch("info_msg", lambda change: 1 / 0, self)
+        config.watch("info_msg", changes.append, self)
+        config.set_var("needs_redraw", not config.get_var("needs_redraw"))
+        config.set_var("info_msg", "watched")
+
+        if changes != [ { "info_msg" : "watched" } ]:
+            raise Exception("Unexpected watched changes: %s" % changes)
+
+        config.unwatch_all(self)
+        config.set_var("info_msg", "")
+
+        if len(changes) != 1:
+            raise Exception("Expected unwatch_all to remove watcher")
+
+        # 17. Option dependencies only advance for their own paths
+
+        deps = config.deps([ "taglist.border", "story" ])
+
+        if config.deps([ "taglist.border", "story" ]) is not deps:
+            raise Exception("Expected deps to be shared")
+
+        gen = deps()
+        config.set_opt("reader.enumerate_links", False)
+
+        if deps() != gen:
+            raise Exception("Expected unrelated change to leave deps alone")
+
+        config.set_opt("taglist.border", not config.get_opt("taglist.border"))
+
+        if deps() <= gen:
+            raise Exception("Expected taglist.border change to advance deps")
+
         return True
 
 TestConfigFunction("config function")
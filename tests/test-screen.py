@@ -13,10 +13,12 @@ from base import *
 from canto_curses.main import CANTO_PROTOCOL_COMPATIBLE
 from canto_curses.config import config
 from canto_curses.tagcore import tag_updater, alltagcores
+from canto_curses.attrstore import AttrRecord
 from canto_curses.gui import CantoCursesGui, GraphicalLog # to Screen to curses
 from canto_curses.locks import sync_lock
 from canto_curses.taglist import TagList
 from canto_curses.tag import alltags
+import canto_curses.tag
 
 from canto_next.hooks import on_hook, call_hook
 
@@ -120,6 +122,11 @@ class TestScreen(Test):
             if target_object.parent_tag not in taglist.tags:
                 raise Exception("Story %s parent tag not in taglist.tags!")
 
+            tag = target_object.parent_tag
+            if tag[target_object.rel_offset] is not target_object or\
+                    target_object.offset != tag.item_offset + target_object.rel_offset:
+                raise Exception("Story %s has the wrong offsets!" % summary)
+
         if recurse_attr:
             self.check_taglist_obj(taglist, getattr(target_object, recurse_attr), recurse_attr)
 
@@ -210,6 +217,11 @@ class TestScreen(Test):
         if summ[1] != ("maintag:Tag(0)", 0):
             raise Exception("Failed to properly set first_sel on :collapse")
 
+        # The viewport walk should carry on past the collapsed tag.
+
+        if "maintag:Tag(1)" not in tag_updater.priority_tags:
+            raise Exception("Expected Tag(1) on screen: %s" % tag_updater.priority_tags)
+
         # The selection after that should be the first story of the next
         # (uncollapsed) tag.
 
@@ -306,6 +318,140 @@ class TestScreen(Test):
         if curses.pairs[8] != [ 0, 0 ]:
             raise Exception("Pair not immediately honored! %s" % curses.pairs[8])
 
+    # Tag counters should follow story state without a recount.
+
+    def test_counts(self):
+        sync_lock.acquire_write()
+
+        tag = alltags[0]
+        if tag.get_counts()["unread"] != len(tag):
+            raise Exception("Expected all unread: %s" % tag.get_counts())
+
+        story = tag[0]
+        story.handle_state("read")
+        story.mark()
+        story.handle_tag("user:test")
+
+        counts = tag.get_counts()
+        if counts["unread"] != len(tag) - 1 or counts["read"] != 1 or\
+                counts["marked"] != 1:
+            raise Exception("Counts didn't follow state: %s" % counts)
+
+        if tag.get_user_tag_counts() != { "user:test" : 1 }:
+            raise Exception("Unexpected user tags: %s" % tag.get_user_tag_counts())
+
+        # An evicted (empty) record says nothing about the story's state, so
+        # it shouldn't change the counts either.
+
+        content = story.content
+        story.new_content = AttrRecord(story.id, content.version + 1,\
+                tag_updater.attributes.empty_layout, ())
+        story.sync()
+
+        if tag.get_counts() != counts:
+            raise Exception("Eviction changed counts: %s" % tag.get_counts())
+
+        # Nor should we make up state for it to send to the daemon.
+
+        if story.handle_state("-read"):
+            raise Exception("Expected no state change without canto-state")
+
+        story.content = content
+
+        story.handle_state("-read")
+        story.unmark()
+        story.handle_tag("-user:test")
+
+        if tag.get_counts()["unread"] != len(tag) or tag.get_user_tag_counts():
+            raise Exception("Counts didn't revert: %s" % tag.get_counts())
+
+        sync_lock.release_write()
+
+    # A sync past its deadline should stop after a chunk of stories, showing
+    # each one in their final order, and pick up where it left off.
+
+    def test_sliced_sync(self):
+        sync_lock.acquire_write()
+
+        tag = alltags[2]
+        ids = list(tag.tagcore)
+
+        tag.tagcore.set_items([])
+        tag.sync()
+
+        chunk = canto_curses.tag.SYNC_CHUNK
+        canto_curses.tag.SYNC_CHUNK = 4
+
+        tag.tagcore.set_items(ids)
+
+        if tag.sync(deadline=time.time()):
+            raise Exception("Expected sync to stop at deadline")
+
+        if tag.get_ids() != ids[:4]:
+            raise Exception("Expected first chunk to be shown: %s" % tag.get_ids())
+
+        # Counters only cover the stories shown so far.
+
+        calls = 1
+        while True:
+            calls += 1
+            done = tag.sync(deadline=time.time())
+
+            counts = tag.get_counts()
+            if counts["unread"] > len(tag) or counts["read"] < 0:
+                raise Exception("Counts don't match shown stories: %s" % counts)
+
+            if tag.get_ids() != ids[:4 * calls]:
+                raise Exception("Expected slice %d to be shown: %s" % (calls, tag.get_ids()))
+
+            if done:
+                break
+
+        if calls != len(ids) // 4:
+            raise Exception("Expected %d calls, got %d" % (len(ids) // 4, calls))
+
+        if tag.get_ids() != ids or [ s.index for s in tag ] != list(range(len(ids))):
+            raise Exception("Expected full tag after sync: %s" % tag.get_ids())
+
+        # With a story on screen, the sync should work down from it and then
+        # back up.
+
+        tag.tagcore.set_items(ids[8:12])
+        tag.sync()
+
+        # Keep the stories in tag order, whatever update.style says.
+
+        tag.tagcore.set_items(ids)
+        tag.tagcore.was_reset = True
+        tag.view_story = tag[0]
+
+        tag.sync(deadline=time.time())
+        if tag.get_ids() != ids[8:16]:
+            raise Exception("Expected stories below view first: %s" % tag.get_ids())
+
+        while not tag.sync(deadline=time.time()):
+            pass
+
+        canto_curses.tag.SYNC_CHUNK = chunk
+
+        if tag.get_ids() != ids or [ s.index for s in tag ] != list(range(len(ids))):
+            raise Exception("Expected full tag after view sync: %s" % tag.get_ids())
+
+        sync_lock.release_write()
+
+        # Emptying the tag made TagUpdater forget its attributes. The same
+        # ATTRIBUTES was processed at startup, so inject can return early,
+        # wait until they're really back before letting the GUI go.
+
+        items = self.tag_backend.script["ITEMS"]["['maintag:Tag(2)']"]
+        self.tag_backend.inject("ATTRIBUTES", items[2][1])
+
+        while [ r for r in tag_updater.get_all_attributes(ids) if "title" not in r ]:
+            time.sleep(0.1)
+
+        self.gui.release_gui()
+        self.wait_on_update()
+
     def test_del(self):
         self.config_backend.inject("DELTAGS", [ "maintag:Tag(1)" ])
         time.sleep(1)
@@ -324,6 +470,9 @@ class TestScreen(Test):
         self.test_command("uncollapse", self.test_uncollapse)
         self.test_command("color 8 black black", self.test_color)
 
+        self.test_counts()
+        self.test_sliced_sync()
+
         self.test_sel_disappear()
 
         self.test_command("next-item", None, True)
@@ -5,10 +5,12 @@ from base import *
 
 from canto_curses.main import CANTO_PROTOCOL_COMPATIBLE
 from canto_curses.config import config
-from canto_curses.tagcore import tag_updater, alltagcores
+from canto_curses.tagcore import tag_updater, alltagcores, diff_ids
 
 from canto_next.hooks import on_hook, call_hook
 
+from collections import deque
+
 ITEMS_REMOVED = 1
 ITEMS_ADDED = 2
 NEW_TC = 4
@@ -25,6 +27,14 @@ class FakeStory(object):
     def __init__(self, id):
         self.id = id
 
+class FakeLane(object):
+    def __init__(self):
+        self.items_queue = deque()
+        self.output = []
+
+    def write(self, cmd, args):
+        self.output.append((cmd, args))
+
 class TestTagCoreFunction(Test):
 
     def reset_flags(self):
@@ -235,6 +245,288 @@ class TestTagCoreFunction(Test):
         self.compare_flags(TAG_UPDATED | UPDATE_COMPLETE | ITEMS_ADDED | ATTRIBUTES)
         self.compare_var("otu_tag", "maintag:Test1")
 
+        # 13. ITEMS diffs keep the daemon's order, reporting added items in
+        # that order.
+
+        self.reset_flags()
+
+        tag_backend.inject("ITEMS", { "maintag:Test1" : [ "id6", "id4", "id5" ] })
+        tag_backend.inject("ITEMSDONE", {})
+
+        self.compare_flags(ITEMS_ADDED | ITEMS_REMOVED)
+        self.compare_var("oia_tcids", [ "id6", "id5" ])
+        self.compare_var("oir_tcids", [ "id3" ])
+
+        for tc in alltagcores:
+            if tc.tag == "maintag:Test1":
+                if tc != [ "id6", "id4", "id5" ]:
+                    raise Exception("Unexpected tagcore order: %s" % tc)
+
+        if diff_ids([ "a", "b", "c" ], [ "d", "c", "a" ]) !=\
+                ([ 0 ], [ (0, 2), (2, 1) ], [ 1 ]):
+            raise Exception("Unexpected diff_ids result")
+
+        # 14. Repeated attribute values are only stored once
+
+        tag_backend.inject("ATTRIBUTES", { "id5" : { "canto-state" : [ "read" ] },\
+                "id6" : { "canto-state" : [ "read" ] }})
+
+        id5_got = tag_updater.get_attributes("id5")
+        id6_got = tag_updater.get_attributes("id6")
+
+        if id5_got != { "canto-state" : [ "read" ] }:
+            raise Exception("Bad content: got %s" % id5_got)
+
+        if id5_got["canto-state"] is not id6_got["canto-state"]:
+            raise Exception("Expected canto-state to be shared")
+
+        # 15. Attribute records are versioned, and local changes survive a
+        # stale response from the daemon.
+
+        self.reset_flags()
+
+        before = tag_updater.get_attributes("id5")
+        changed = tag_updater.change_attributes("id5", { "canto-state" : [] })
+
+        self.compare_flags(ATTRIBUTES)
+
+        if changed.version <= before.version:
+            raise Exception("Expected local change to bump version")
+
+        if before["canto-state"] != ( "read", ):
+            raise Exception("Expected old record to be unchanged")
+
+        tag_backend.inject("ATTRIBUTES", { "id5" : { "canto-state" : [ "read" ],\
+                "title" : "id5" }})
+
+        id5_got = tag_updater.get_attributes("id5")
+        if id5_got != { "canto-state" : [], "title" : "id5" }:
+            raise Exception("Expected local change to be kept, got %s" % id5_got)
+
+        if id5_got.version <= changed.version:
+            raise Exception("Expected update to bump version")
+
+        tag_backend.inject("ATTRIBUTES", { "id5" : { "canto-state" : [ "read" ] }})
+
+        if tag_updater.get_attributes("id5")["canto-state"] != ( "read", ):
+            raise Exception("Expected local change to only apply once")
+
+        # 16. Attribute requests are batched until flushed, and not repeated
+        # while they're in flight.
+
+        sent = len(tag_backend.output)
+
+        tag_updater.need_attributes([ "id4", "id6" ], [ "description" ])
+        tag_updater.request_attributes("id4", [ "title", "description" ])
+        tag_updater.request_attributes("id5", [])
+
+        if len(tag_backend.output) != sent:
+            raise Exception("Expected requests to wait for flush")
+
+        tag_updater.flush_attributes()
+
+        output = tag_backend.output[sent:]
+        if [ cmd for (cmd, args) in output ] != [ "AUTOATTR", "ATTRIBUTES" ]:
+            raise Exception("Unexpected flush output: %s" % output)
+
+        if sorted(output[1][1].keys()) != [ "id4", "id5", "id6" ] or\
+                output[1][1]["id5"] != []:
+            raise Exception("Unexpected ATTRIBUTES: %s" % output[1][1])
+
+        sent = len(tag_backend.output)
+
+        tag_updater.request_attributes("id4", [ "description" ])
+        tag_updater.flush_attributes()
+
+        if len(tag_backend.output) != sent:
+            raise Exception("Expected in flight request to be skipped")
+
+        tag_backend.inject("ATTRIBUTES", { "id4" : { "description" : "" }})
+
+        tag_updater.request_attributes("id4", [ "description" ])
+        tag_updater.flush_attributes()
+
+        if tag_backend.output[sent:] != [ ("ATTRIBUTES", { "id4" : [ "description" ] }) ]:
+            raise Exception("Expected request after response to be sent")
+
+        # 17. Lazy mode turns off AUTOATTR, and only fetches attributes when
+        # asked for, or when we're idle.
+
+        sent = len(tag_backend.output)
+
+        config.set_opt("update.lazy.enabled", True)
+
+        if tag_backend.output[sent:] != [ ("AUTOATTR", []) ]:
+            raise Exception("Expected lazy mode to clear AUTOATTR")
+
+        tag_backend.inject("ITEMS", { "maintag:Test1" : [ "id6", "id4", "id5", "id7", "id8" ] })
+        tag_backend.inject("ITEMSDONE", {})
+
+        tag_backend.inject("ATTRIBUTES", { "id4" :\
+                dict([ (attr, "") for attr in tag_updater.needed_attrs ]) })
+
+        sent = len(tag_backend.output)
+
+        tag_updater.want_attributes([ "id7", "id4" ])
+        tag_updater.flush_attributes()
+
+        output = tag_backend.output[sent:]
+        if len(output) != 1 or list(output[0][1].keys()) != [ "id7" ]:
+            raise Exception("Expected only missing attributes, got %s" % output)
+
+        # Attributes primed from the cache are asked for again, once.
+
+        tag_updater.stale["id4"] = True
+
+        sent = len(tag_backend.output)
+
+        tag_updater.want_attributes([ "id4" ])
+        tag_updater.flush_attributes()
+
+        output = tag_backend.output[sent:]
+        if len(output) != 1 or list(output[0][1].keys()) != [ "id4" ]:
+            raise Exception("Expected stale attributes to be fetched, got %s" % output)
+
+        tag_backend.inject("ATTRIBUTES", { "id4" :\
+                dict([ (attr, "") for attr in tag_updater.needed_attrs ]) })
+
+        if "id4" in tag_updater.stale:
+            raise Exception("Expected fresh attributes to clear stale")
+
+        config.set_opt("update.lazy.fill", 0)
+
+        sent = len(tag_backend.output)
+
+        tag_updater.fill_attributes()
+
+        if tag_backend.output[sent:] != []:
+            raise Exception("Expected no idle fill with update.lazy.fill = 0")
+
+        config.set_opt("update.lazy.fill", 500)
+
+        sent = len(tag_backend.output)
+
+        tag_updater.fill_attributes()
+
+        output = tag_backend.output[sent:]
+        if len(output) != 1 or list(output[0][1].keys()) != [ "id8" ]:
+            raise Exception("Expected idle fill of id8, got %s" % output)
+
+        config.set_opt("update.lazy.enabled", False)
+
+        # 18. Over budget, the least recently used attributes are evicted and
+        # holders are given an empty record.
+
+        self.reset_flags()
+
+        tag_updater.touch_attributes([ "id4" ])
+        tag_updater.attributes.budget = tag_updater.attributes.size
+
+        tag_backend.inject("ATTRIBUTES", { "id9" : { "title" : "id9" }})
+
+        self.compare_flags(ATTRIBUTES)
+
+        if "id9" not in tag_updater.attributes or "id4" not in tag_updater.attributes:
+            raise Exception("Expected recently used attributes to be kept")
+
+        evicted = [ id for id in self.attributes if id != "id9" ]
+        if not evicted:
+            raise Exception("Expected attributes to be evicted")
+
+        for id in evicted:
+            if id in tag_updater.attributes or self.attributes[id] != {}:
+                raise Exception("Expected %s to be evicted" % id)
+
+        if tag_updater.attributes.stats()["evictions"] != len(evicted):
+            raise Exception("Unexpected stats: %s" % tag_updater.attributes.stats())
+
+        tag_updater.attributes.budget = 0
+
+        # 19. ITEMS deltas only add and remove what they mention
+
+        self.reset_flags()
+
+        tag_backend.inject("ITEMS", { "maintag:Test1" :\
+                { "add" : [ "id9", "id4" ], "remove" : [ "id5", "idX" ] }})
+        tag_backend.inject("ITEMSDONE", {})
+
+        self.compare_flags(ITEMS_ADDED | ITEMS_REMOVED)
+        self.compare_var("oia_tcids", [ "id9" ])
+        self.compare_var("oir_tcids", [ "id5" ])
+
+        for tc in alltagcores:
+            if tc.tag == "maintag:Test1":
+                if tc != [ "id6", "id4", "id7", "id8", "id9" ]:
+                    raise Exception("Unexpected tagcore after delta: %s" % tc)
+
+        # 20. Subscribers only get updates for their own ID, until they
+        # unsubscribe.
+
+        got = []
+        sub = lambda record : got.append(record.id)
+
+        tag_updater.subscribe([ "id6" ], sub)
+        tag_backend.inject("ATTRIBUTES", { "id6" : { "title" : "id6" },\
+                "id7" : { "title" : "id7" }})
+
+        if got != [ "id6" ]:
+            raise Exception("Expected only id6 to be delivered, got %s" % got)
+
+        tag_updater.change_attributes("id6", { "canto-state" : [] })
+
+        if got != [ "id6", "id6" ]:
+            raise Exception("Expected local change to be delivered, got %s" % got)
+
+        tag_updater.unsubscribe([ "id6" ], sub)
+        tag_backend.inject("ATTRIBUTES", { "id6" : { "title" : "id6" }})
+
+        if len(got) != 2 or "id6" in tag_updater.subscribers:
+            raise Exception("Expected unsubscribe to stop delivery")
+
+        # 21. TagCore positions stay consistent through full lists and deltas
+
+        for tc in alltagcores:
+            if tc.tag == "maintag:Test1":
+                break
+
+        tag_backend.inject("ITEMS", { "maintag:Test1" : [ "id4", "id7", "id6", "id8" ] })
+        tag_backend.inject("ITEMSDONE", {})
+
+        tag_backend.inject("ITEMS", { "maintag:Test1" :\
+                { "add" : [ "id5" ], "remove" : [ "id7" ] }})
+        tag_backend.inject("ITEMSDONE", {})
+
+        for i, id in enumerate(tc):
+            if tc.position(id) != i:
+                raise Exception("Expected %s at %d, got %s" % (id, i, tc.position(id)))
+
+        if len(tc.positions) != len(tc) or "id7" in tc or tc.position("id7") != None:
+            raise Exception("Expected id7 to be gone: %s" % tc.positions)
+
+        # 22. A tag waiting on ITEMS stays on its lane when it becomes a
+        # priority tag, until its responses are done.
+
+        lanes = [ FakeLane(), FakeLane(), FakeLane() ]
+        tag_updater.lanes = lanes
+
+        tag_updater.write_items("maintag:Test1")
+        tag_updater.set_priority_tags([ "maintag:Test1" ])
+        tag_updater.write_items("maintag:Test1")
+
+        used = [ lane for lane in lanes if lane.output ]
+        if len(used) != 1 or used[0] is lanes[0] or len(used[0].output) != 2:
+            raise Exception("Expected one non-priority lane for both requests")
+
+        tag_updater.items_done(used[0])
+        tag_updater.items_done(used[0])
+        tag_updater.write_items("maintag:Test1")
+
+        if lanes[0].output != [ ("ITEMS", [ "maintag:Test1" ]) ]:
+            raise Exception("Expected priority lane once requests were done")
+
+        tag_updater.lanes = []
+        tag_updater.set_priority_tags([])
+        tag_updater.items_done(lanes[0])
 
         return True
 